@@ -0,0 +1,173 @@
+# ~/idol_voting/backend/admission.py
+"""
+Admission control and load shedding, per worker process.
+
+Requests are classified by path before routing and each class gets its own concurrency
+limit and wait queue, so a vote spike can't take every threadpool thread / DB connection:
+
+- admin: /api/admin/* (authenticated), with ADMISSION_ADMIN_RESERVED slots no other class may use
+- vote: /api/vote/submit
+- auth: /api/auth/* and /api/admin/login, which is unauthenticated and bcrypt-bound, so a
+  login flood can't take the capacity reserved for signed-in admins
+- read: everything else under /api (contestants, vote state/history, leaderboard); lowest
+  priority, and shed outright while the vote/auth latency SLO is breached
+
+A request that can't start waits in its class's queue for at most the class's queue timeout;
+a full queue or a timeout answers 503 with Retry-After. Freed slots go to waiting requests
+in priority order (admin, vote, auth, read).
+"""
+import asyncio
+import collections
+import os
+import time
+
+from fastapi.responses import JSONResponse
+
+import metrics
+
+MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "40"))  # anyio's default threadpool size
+ADMIN_RESERVED = int(os.getenv("ADMISSION_ADMIN_RESERVED", "4"))
+LATENCY_SLO_SECONDS = float(os.getenv("ADMISSION_LATENCY_SLO_MS", "750")) / 1000
+# Latency samples older than this no longer count towards the SLO
+SLO_WINDOW_SECONDS = 10.0
+LATENCY_EWMA_WEIGHT = 0.1
+
+
+class RouteClass:
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout: float, retry_after: int, sheddable: bool = False):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        # Shed without queueing while the latency SLO is breached
+        self.sheddable = sheddable
+        self.in_flight = 0
+        self.waiters = collections.deque()
+
+
+def _class_from_env(name: str, limit: int, max_queue: int, queue_timeout: float, retry_after: int, sheddable: bool = False) -> RouteClass:
+    prefix = f"ADMISSION_{name.upper()}"
+    return RouteClass(
+        name,
+        limit=int(os.getenv(f"{prefix}_LIMIT", str(limit))),
+        max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", str(max_queue))),
+        queue_timeout=float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", str(queue_timeout))),
+        retry_after=retry_after,
+        sheddable=sheddable,
+    )
+
+
+class AdmissionController:
+    """Runs on the worker's event loop only, so the counters need no locking."""
+
+    def __init__(self, classes: list, max_concurrency: int = MAX_CONCURRENCY, admin_reserved: int = ADMIN_RESERVED, latency_slo: float = LATENCY_SLO_SECONDS):
+        # In priority order: freed slots go to the first class with a waiter that may start
+        self.classes = {route_class.name: route_class for route_class in classes}
+        self.max_concurrency = max_concurrency
+        self.admin_reserved = admin_reserved
+        self.latency_slo = latency_slo
+        self.in_flight = 0
+        self._latency = 0.0
+        self._latency_updated = 0.0
+
+    def classify(self, path: str):
+        if not path.startswith("/api/"):
+            return None  # /metrics, / and the docs are never limited
+        if path.rstrip("/") == "/api/admin/login":
+            return self.classes["auth"]
+        if path.startswith("/api/admin/"):
+            return self.classes["admin"]
+        if path == "/api/vote/submit":
+            return self.classes["vote"]
+        if path.startswith("/api/auth/"):
+            return self.classes["auth"]
+        return self.classes["read"]
+
+    def slo_breached(self) -> bool:
+        return self._latency > self.latency_slo and time.monotonic() - self._latency_updated < SLO_WINDOW_SECONDS
+
+    def _can_start(self, route_class: RouteClass) -> bool:
+        shared_limit = self.max_concurrency - (0 if route_class.name == "admin" else self.admin_reserved)
+        return route_class.in_flight < route_class.limit and self.in_flight < shared_limit
+
+    def _start(self, route_class: RouteClass):
+        route_class.in_flight += 1
+        self.in_flight += 1
+
+    def _finish(self, route_class: RouteClass):
+        route_class.in_flight -= 1
+        self.in_flight -= 1
+        # Hand the freed capacity to waiting requests, highest priority class first
+        for waiting_class in self.classes.values():
+            while waiting_class.waiters and self._can_start(waiting_class):
+                waiter = waiting_class.waiters.popleft()
+                if not waiter.done():
+                    self._start(waiting_class)
+                    waiter.set_result(True)
+
+    def observe_latency(self, route_class: RouteClass, seconds: float):
+        if route_class.name in ("vote", "auth"):
+            self._latency += LATENCY_EWMA_WEIGHT * (seconds - self._latency)
+            self._latency_updated = time.monotonic()
+
+    async def admit(self, route_class: RouteClass):
+        """Returns None once the request may start, or the reason it was shed."""
+        if route_class.sheddable and self.slo_breached():
+            return "slo"
+        if self._can_start(route_class) and not route_class.waiters:
+            self._start(route_class)
+            return None
+        if len(route_class.waiters) >= route_class.max_queue:
+            return "queue_full"
+        waiter = asyncio.get_running_loop().create_future()
+        route_class.waiters.append(waiter)
+        metrics.ADMISSION_QUEUE_DEPTH.labels(route_class.name).inc()
+        try:
+            await asyncio.wait({waiter}, timeout=route_class.queue_timeout)
+        except BaseException:
+            # Client went away while queued; give back the slot if it was granted meanwhile
+            if waiter.done():
+                self._finish(route_class)
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            metrics.ADMISSION_QUEUE_DEPTH.labels(route_class.name).dec()
+        if waiter.done():
+            return None  # _finish() already counted us in
+        waiter.cancel()
+        try:
+            route_class.waiters.remove(waiter)
+        except ValueError:
+            pass
+        return "queue_timeout"
+
+    async def __call__(self, request, call_next):
+        """HTTP middleware."""
+        route_class = self.classify(request.url.path)
+        # CORS preflights are cheap and never reach a handler; shedding them would fail the real request
+        if route_class is None or request.method == "OPTIONS":
+            return await call_next(request)
+        shed_reason = await self.admit(route_class)
+        if shed_reason is not None:
+            metrics.ADMISSION_SHED.labels(route_class.name, shed_reason).inc()
+            return JSONResponse(
+                status_code=503,
+                content={"detail": "The server is busy. Please try again shortly."},
+                headers={"Retry-After": str(route_class.retry_after)},
+            )
+        start = time.perf_counter()
+        try:
+            return await call_next(request)
+        finally:
+            self.observe_latency(route_class, time.perf_counter() - start)
+            self._finish(route_class)
+
+
+controller = AdmissionController([
+    _class_from_env("admin", limit=8, max_queue=50, queue_timeout=10.0, retry_after=2),
+    _class_from_env("vote", limit=28, max_queue=500, queue_timeout=3.0, retry_after=1),
+    _class_from_env("auth", limit=12, max_queue=200, queue_timeout=3.0, retry_after=2),
+    _class_from_env("read", limit=10, max_queue=50, queue_timeout=0.5, retry_after=5, sheddable=True),
+])
@@ -0,0 +1,60 @@
+"""normalize user identifiers
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19 21:12:04.518337
+
+"""
+import logging
+import re
+from collections import defaultdict
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, Sequence[str], None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+# Same rules as schemas.normalize_mobile / normalize_email at the time of this revision
+NORMALIZERS = {
+    'mobile_number': lambda value: re.sub(r"[\s\-().]", "", value) or None,
+    'email': lambda value: value.strip().lower() or None,
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Requests are normalized since user-049, so users stored as e.g. "Fan@Example.com" or
+    # "+91 98765 43210" could no longer be found and got a second account on their next login.
+    # When several rows normalize to the same identifier, the row already holding the normalized
+    # form keeps it (it is the one logins reach today), else the oldest row gets it; the others
+    # keep their raw value, are unreachable from now on, and are logged for manual review.
+    users = sa.table('users', sa.column('id', sa.Integer), sa.column('mobile_number', sa.String), sa.column('email', sa.String))
+    bind = op.get_bind()
+    for column, normalize in NORMALIZERS.items():
+        groups = defaultdict(list)
+        for user_id, value in bind.execute(sa.select(users.c.id, users.c[column]).where(users.c[column].isnot(None)).order_by(users.c.id)):
+            normalized = normalize(value)
+            if normalized is not None:
+                groups[normalized].append((user_id, value))
+        for normalized, rows in groups.items():
+            if any(value == normalized for _, value in rows):
+                left_alone = [user_id for user_id, value in rows if value != normalized]
+            else:
+                op.execute(users.update().where(users.c.id == rows[0][0]).values({column: normalized}))
+                left_alone = [user_id for user_id, _ in rows[1:]]
+            if left_alone:
+                logger.warning("users.%s %r is also held by user ids %s in a non-normalized form; left unchanged", column, normalized, left_alone)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # The original spelling of the identifiers is not kept; nothing to undo
+    pass
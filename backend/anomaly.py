@@ -0,0 +1,228 @@
+# ~/idol_voting/backend/anomaly.py
+"""
+Streaming detector for vote bursts (bot farms voting from freshly created accounts).
+
+The submit path only calls `detector.observe(...)`, which drops the event on a bounded
+queue and returns. A background thread per worker feeds the events into sliding-window
+counters keyed by user, by identifier prefix (mobile number without its last digits, or
+email domain) and by contestant. When a count crosses its threshold the anomaly is written
+to vote_anomalies, which the admin endpoint reads. Thresholds apply per worker, i.e. to
+roughly 1/4 of the traffic.
+
+Per-user and per-contestant counts are exact: a user threshold of 20 is far below what a
+sketch overcounts by at finale traffic. Prefixes use a count-min sketch sized from
+ANOMALY_EXPECTED_SUBMITS (submits per worker per window) so that its overcount stays below
+a quarter of the prefix threshold. `python check_anomaly_detector.py` replays a finale-sized
+load and checks that no honest user is flagged.
+"""
+import logging
+import math
+import os
+import queue
+import threading
+import time
+from array import array
+from collections import defaultdict, namedtuple
+from datetime import datetime, timezone
+
+import crud
+from cache import TTLCache
+from database import SessionLocal
+
+logger = logging.getLogger("idol_voting.anomaly")
+
+WINDOW_SECONDS = int(os.getenv("ANOMALY_WINDOW_SECONDS", "60"))
+FRESH_USER_SECONDS = int(os.getenv("ANOMALY_FRESH_USER_SECONDS", "3600"))
+USER_SUBMITS_THRESHOLD = int(os.getenv("ANOMALY_USER_SUBMITS_THRESHOLD", "20"))
+PREFIX_FRESH_SUBMITS_THRESHOLD = int(os.getenv("ANOMALY_PREFIX_FRESH_SUBMITS_THRESHOLD", "50"))
+CONTESTANT_FRESH_VOTES_THRESHOLD = int(os.getenv("ANOMALY_CONTESTANT_FRESH_VOTES_THRESHOLD", "2000"))
+EXPECTED_SUBMITS = int(os.getenv("ANOMALY_EXPECTED_SUBMITS", "100000"))
+
+
+class SlidingWindowCounter:
+    """Exact counts over a sliding time window; memory grows with the keys seen in the window."""
+
+    def __init__(self, window_seconds: int = WINDOW_SECONDS, slots: int = 6):
+        self.slot_seconds = max(1, window_seconds // slots)
+        self.slots = slots
+        self._counts = [defaultdict(int) for _ in range(slots)]
+        self._slot_ids = [None] * slots
+
+    def add(self, key, count: int = 1, now: float = None) -> int:
+        """Adds `count` for `key` and returns the key's total over the window."""
+        now = time.time() if now is None else now
+        slot_id = int(now // self.slot_seconds)
+        position = slot_id % self.slots
+        if self._slot_ids[position] != slot_id:
+            self._counts[position] = defaultdict(int)
+            self._slot_ids[position] = slot_id
+        self._counts[position][key] += count
+        return self.estimate(key, now)
+
+    def estimate(self, key, now: float = None) -> int:
+        now = time.time() if now is None else now
+        oldest = int(now // self.slot_seconds) - self.slots + 1
+        return sum(counts.get(key, 0) for counts, slot_id in zip(self._counts, self._slot_ids) if slot_id is not None and slot_id >= oldest)
+
+
+class SlidingWindowSketch:
+    """
+    Count-min sketch over a sliding time window, built as a ring of sub-window sketches.
+    Estimates never undercount; memory is depth * width * slots counters.
+    """
+
+    def __init__(self, window_seconds: int = WINDOW_SECONDS, slots: int = 6, width: int = 2048, depth: int = 4):
+        self.slot_seconds = max(1, window_seconds // slots)
+        self.slots = slots
+        self.width = width
+        self.depth = depth
+        self._tables = [array("l", bytes(8 * width * depth)) for _ in range(slots)]
+        self._slot_ids = [None] * slots
+
+    def _indexes(self, key):
+        return [row * self.width + hash((row, key)) % self.width for row in range(self.depth)]
+
+    def _slot(self, now: float) -> array:
+        slot_id = int(now // self.slot_seconds)
+        position = slot_id % self.slots
+        if self._slot_ids[position] != slot_id:
+            # This slot last held counts from a previous lap of the ring: expire them
+            self._tables[position] = array("l", bytes(8 * self.width * self.depth))
+            self._slot_ids[position] = slot_id
+        return self._tables[position]
+
+    def add(self, key, count: int = 1, now: float = None) -> int:
+        """Adds `count` for `key` and returns the key's estimated total over the window."""
+        now = time.time() if now is None else now
+        indexes = self._indexes(key)
+        table = self._slot(now)
+        for index in indexes:
+            table[index] += count
+        return self.estimate(key, now, indexes)
+
+    def estimate(self, key, now: float = None, indexes=None) -> int:
+        now = time.time() if now is None else now
+        indexes = indexes or self._indexes(key)
+        oldest = int(now // self.slot_seconds) - self.slots + 1
+        live = [table for table, slot_id in zip(self._tables, self._slot_ids) if slot_id is not None and slot_id >= oldest]
+        return min(sum(table[index] for table in live) for index in indexes)
+
+
+def sketch_width(expected: int, threshold: int) -> int:
+    # Count-min overcounts by at most e * expected / width (with probability 1 - e^-depth);
+    # keep that below a quarter of the threshold
+    return max(256, math.ceil(4 * math.e * expected / threshold))
+
+
+def identifier_prefix(mobile_number: str = None, email: str = None) -> str:
+    """Groups identifiers that bot farms tend to share: a number range or an email domain."""
+    if mobile_number:
+        digits = "".join(ch for ch in mobile_number if ch.isdigit())
+        return f"mobile:{digits[:-4]}" if len(digits) > 4 else f"mobile:{digits}"
+    if email and "@" in email:
+        return f"email:{email.rsplit('@', 1)[1].lower()}"
+    return "unknown"
+
+
+# What the detector needs to know about a user. The submit path builds it from the loaded
+# models.User before submit_votes commits, since reading the expired ORM object afterwards
+# would reload the row.
+Voter = namedtuple("Voter", "id created_at mobile_number email")
+
+def voter_of(user) -> Voter:
+    return Voter(user.id, user.created_at, user.mobile_number, user.email)
+
+
+class VoteBurstDetector:
+    def __init__(self, session_factory, max_pending: int = 10000):
+        self.session_factory = session_factory
+        self._events = queue.Queue(maxsize=max_pending)
+        self._user_submits = SlidingWindowCounter()
+        self._prefix_fresh_submits = SlidingWindowSketch(width=sketch_width(EXPECTED_SUBMITS, PREFIX_FRESH_SUBMITS_THRESHOLD))
+        self._contestant_fresh_votes = SlidingWindowCounter()
+        # Don't report the same key again until its window has passed
+        self._recently_flagged = TTLCache(maxsize=10000, ttl=WINDOW_SECONDS)
+        self._stopped = threading.Event()
+        self._thread = None
+        self.dropped = 0
+
+    def observe(self, voter: "Voter", voting_line_id: int, votes: dict):
+        """Called from the submit path; never blocks."""
+        event = (time.time(), voter.id, voter.created_at, voter.mobile_number, voter.email, voting_line_id, votes)
+        try:
+            self._events.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="vote-burst-detector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def process(self, event) -> list:
+        """Updates the sketches with one event and returns any anomalies it triggers."""
+        now, user_id, user_created_at, mobile_number, email, voting_line_id, votes = event
+        anomalies = []
+        submits = self._user_submits.add(user_id, now=now)
+        if submits > USER_SUBMITS_THRESHOLD:
+            anomalies.append(("user", str(user_id), voting_line_id, submits, USER_SUBMITS_THRESHOLD))
+
+        if user_created_at is not None:
+            created_at = user_created_at if user_created_at.tzinfo else user_created_at.replace(tzinfo=timezone.utc)
+            if now - created_at.timestamp() <= FRESH_USER_SECONDS:
+                prefix = identifier_prefix(mobile_number, email)
+                prefix_submits = self._prefix_fresh_submits.add(prefix, now=now)
+                if prefix_submits > PREFIX_FRESH_SUBMITS_THRESHOLD:
+                    anomalies.append(("identifier_prefix", prefix, voting_line_id, prefix_submits, PREFIX_FRESH_SUBMITS_THRESHOLD))
+                for contestant_id, vote_count in votes.items():
+                    if vote_count <= 0:
+                        continue
+                    contestant_votes = self._contestant_fresh_votes.add((voting_line_id, int(contestant_id)), vote_count, now=now)
+                    if contestant_votes > CONTESTANT_FRESH_VOTES_THRESHOLD:
+                        anomalies.append(("contestant", str(contestant_id), voting_line_id, contestant_votes, CONTESTANT_FRESH_VOTES_THRESHOLD))
+
+        fresh = []
+        for anomaly in anomalies:
+            flag_key = anomaly[:3]
+            if self._recently_flagged.get(flag_key) is None:
+                self._recently_flagged.set(flag_key, True)
+                fresh.append(anomaly)
+        return fresh
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                batch = [self._events.get(timeout=1)]
+            except queue.Empty:
+                continue
+            # Take whatever else is queued so flags are written in one batch
+            while len(batch) < 1000:
+                try:
+                    batch.append(self._events.get_nowait())
+                except queue.Empty:
+                    break
+            anomalies = [anomaly for event in batch for anomaly in self.process(event)]
+            if not anomalies:
+                continue
+            db = self.session_factory()
+            try:
+                crud.record_vote_anomalies(db, [
+                    {"kind": kind, "key": key, "voting_line_id": line_id, "observed": observed, "threshold": threshold, "window_seconds": WINDOW_SECONDS, "detected_at": datetime.now(timezone.utc)}
+                    for kind, key, line_id, observed, threshold in anomalies
+                ])
+            except Exception:
+                logger.exception("Could not record %d vote anomalies", len(anomalies))
+            finally:
+                db.close()
+
+
+# One detector per worker process, started and stopped by the app's lifespan in main.py
+detector = VoteBurstDetector(SessionLocal)
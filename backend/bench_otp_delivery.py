@@ -0,0 +1,58 @@
+# ~/idol_voting/backend/bench_otp_delivery.py
+"""
+Delivery benchmark for OTPs.
+
+Sends the same burst of OTP messages through a FakeProvider with a fixed per-call gateway
+latency twice: once the way a sender wired into crud.create_otp would, one gateway call per
+request, and once through an OTPDeliveryQueue, which batches them. It reports how long the
+request path is blocked and how long until every message is sent. With a failure rate the
+queue's retries are exercised too; every message must still be sent exactly once. No
+database is needed.
+
+Usage: python bench_otp_delivery.py [messages] [latency_ms] [failure_rate]
+"""
+import sys
+import time
+
+from otp_delivery import FakeProvider, OTPDeliveryQueue, OTPMessage
+import otp_delivery
+
+def messages(count: int) -> list:
+    expires_at = time.time() + 300
+    return [OTPMessage("sms", f"+99{n:010d}", f"{n % 1000000:06d}", expires_at) for n in range(count)]
+
+def synchronous(burst: list, latency: float) -> float:
+    provider = FakeProvider(latency=latency)
+    start = time.perf_counter()
+    for message in burst:
+        provider.send_batch([message])
+    return time.perf_counter() - start
+
+def queued(burst: list, latency: float, failure_rate: float):
+    provider = FakeProvider(latency=latency, failure_rate=failure_rate)
+    delivery = OTPDeliveryQueue({"sms": provider}, max_pending=len(burst))
+    delivery.start()
+    start = time.perf_counter()
+    for message in burst:
+        assert delivery.enqueue(message)
+    enqueued = time.perf_counter() - start
+    while len(provider.sent) < len(burst) and time.perf_counter() - start < 120:
+        time.sleep(0.001)
+    sent = time.perf_counter() - start
+    delivery.stop()
+    assert sorted(provider.sent) == sorted(burst), f"{len(provider.sent)} of {len(burst)} messages sent"
+    return enqueued, sent, provider
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.02
+    failure_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    otp_delivery.RETRY_BASE_SECONDS = 0.05  # keep the retry run short
+    burst = messages(count)
+
+    print(f"--- {count} OTPs, {latency * 1000:.0f} ms per gateway call, failure rate {failure_rate:.0%} ---")
+    seconds = synchronous(burst, latency)
+    print(f"synchronous send: request path blocked {seconds * 1e3 / count:.1f} ms per OTP, all sent after {seconds:.2f}s")
+    enqueued, sent, provider = queued(burst, latency, failure_rate)
+    print(f"delivery queue:   request path blocked {enqueued * 1e6 / count:.1f} us per OTP, all sent after {sent:.2f}s "
+          f"({provider.batches} gateway calls, {provider.failures} retried)")
@@ -0,0 +1,49 @@
+# ~/idol_voting/backend/bench_startup.py
+"""
+Cold-start benchmark for a gunicorn worker.
+
+Each run imports `main` in a fresh interpreter (what every worker does on boot) and
+reports how long the import took and how many SQL statements were issued while
+importing. With the schema managed by alembic the statement count should be 0.
+
+Usage: python bench_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+# Runs inside the child interpreter; prints "<seconds> <sql statements>"
+CHILD_SCRIPT = """
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+statements = []
+event.listen(Engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+start = time.perf_counter()
+import main
+print(time.perf_counter() - start, len(statements))
+"""
+
+def run_once() -> tuple:
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True,
+    )
+    seconds, statement_count = result.stdout.strip().splitlines()[-1].split()
+    return float(seconds), int(statement_count)
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    timings, statement_counts = [], []
+    for _ in range(runs):
+        seconds, statement_count = run_once()
+        timings.append(seconds)
+        statement_counts.append(statement_count)
+
+    print(f"--- Worker cold start ({runs} runs) ---")
+    print(f"import main: min {min(timings) * 1000:.1f} ms, median {statistics.median(timings) * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms")
+    print(f"SQL statements during import: {max(statement_counts)}")
@@ -0,0 +1,56 @@
+# ~/idol_voting/backend/bench_voting_state.py
+"""
+Serialization benchmark for /api/vote/state.
+
+Compares the per-request cost of rendering the voting page the way FastAPI does for a
+response_model (validate into schemas.PublicVotingPage, dump to JSON-able data, json.dumps)
+with the prebuilt per-line prefix from crud.get_voting_page_prefix plus the spliced-in
+user_total_votes. Both outputs are checked to be byte-for-byte identical. No database is
+needed; the line and its contestants are built in memory.
+
+Usage: python bench_voting_state.py [contestants] [iterations]
+"""
+import json
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from pydantic import TypeAdapter
+
+import crud
+import schemas
+
+_page = TypeAdapter(schemas.PublicVotingPage)
+
+def pydantic_path(line: schemas.VotingLine, user_total_votes: int) -> bytes:
+    # What FastAPI does with response_model=schemas.PublicVotingPage and a JSONResponse
+    page = _page.validate_python({"voting_line": line, "contestants": line.contestants, "user_total_votes": user_total_votes})
+    content = _page.dump_python(page, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def prebuilt_path(line: schemas.VotingLine, user_total_votes: int) -> bytes:
+    return crud.get_voting_page_prefix(line) + b"%d}" % user_total_votes
+
+def build_line(contestant_count: int) -> schemas.VotingLine:
+    now = datetime.now(timezone.utc)
+    contestants = [
+        schemas.Contestant(id=n, name=f"Contestant {n}", age=18 + n % 10, gender=("Male", "Female", "Others")[n % 3],
+                           details="Sings ghazals and Bollywood classics. " * 4, image_url=f"images/contestant-{n}.jpg", created_at=now)
+        for n in range(1, contestant_count + 1)
+    ]
+    return schemas.VotingLine(id=1, name="Grand Finale", start_time=now, end_time=now + timedelta(hours=2), max_votes_per_user=50,
+                              is_active=True, contestants=contestants, created_at=now)
+
+if __name__ == "__main__":
+    contestant_count = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    line = build_line(contestant_count)
+    assert pydantic_path(line, 37) == prebuilt_path(line, 37), "prebuilt payload differs from the response_model output"
+
+    print(f"--- /api/vote/state body, {contestant_count} contestants, {len(prebuilt_path(line, 37))} bytes ---")
+    results = {}
+    for name, render in (("pydantic response_model", pydantic_path), ("prebuilt prefix", prebuilt_path)):
+        seconds = min(timeit.repeat(lambda: render(line, 37), number=iterations, repeat=5))
+        results[name] = seconds / iterations
+        print(f"{name}: {results[name] * 1e6:.1f} us per response")
+    print(f"speedup: {results['pydantic response_model'] / results['prebuilt prefix']:.1f}x")
@@ -0,0 +1,61 @@
+# ~/idol_voting/backend/check_anomaly_detector.py
+"""
+False-positive check for the vote burst detector at finale load.
+
+Feeds one worker's detector a window of synthetic traffic: many honest users who each submit
+a few times (some of them freshly registered, on random numbers), plus one user who submits
+far too often and a bot farm of fresh accounts on one number range. It checks that the
+user and identifier prefix rules flag the two bots and no honest user or prefix. Nothing
+is written to the database, but importing the app modules needs DATABASE_URL set.
+
+Usage: python check_anomaly_detector.py [submits_per_window]
+"""
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+import anomaly
+
+HONEST_SUBMITS_PER_USER = (1, 5)
+FRESH_SHARE = 0.2
+
+def honest_events(submits: int, start: float, line_id: int) -> list:
+    events, user_id = [], 0
+    while len(events) < submits:
+        user_id += 1
+        fresh = random.random() < FRESH_SHARE
+        created_at = datetime.fromtimestamp(start, timezone.utc) - (timedelta(minutes=5) if fresh else timedelta(days=30))
+        mobile = f"+91{random.randrange(6000000000, 9999999999)}"
+        for _ in range(random.randint(*HONEST_SUBMITS_PER_USER)):
+            events.append((start + random.random() * anomaly.WINDOW_SECONDS * 0.9, user_id, created_at, mobile, None, line_id, {str(random.randint(1, 12)): random.randint(1, 10)}))
+    return events
+
+def bot_events(start: float, line_id: int, first_user_id: int) -> list:
+    created_at = datetime.fromtimestamp(start, timezone.utc) - timedelta(minutes=1)
+    spammer = [(start + n, first_user_id, created_at - timedelta(days=30), "+919000000000", None, line_id, {"1": 1}) for n in range(anomaly.USER_SUBMITS_THRESHOLD * 2)]
+    farm = [(start + n * 0.1, first_user_id + 1 + n, created_at, f"+9177770{n:05d}", None, line_id, {"1": 1}) for n in range(anomaly.PREFIX_FRESH_SUBMITS_THRESHOLD * 4)]
+    return spammer + farm
+
+if __name__ == "__main__":
+    submits = int(sys.argv[1]) if len(sys.argv) > 1 else anomaly.EXPECTED_SUBMITS
+    random.seed(7)
+    start = (datetime.now(timezone.utc).timestamp() // anomaly.WINDOW_SECONDS) * anomaly.WINDOW_SECONDS
+    events = honest_events(submits, start, line_id=1)
+    honest_users = events[-1][1]
+    events += bot_events(start, line_id=1, first_user_id=honest_users + 1)
+    events.sort(key=lambda event: event[0])
+
+    detector = anomaly.VoteBurstDetector(session_factory=None)
+    flagged = [flag for event in events for flag in detector.process(event)]
+    users = {key for kind, key, *_ in flagged if kind == "user"}
+    prefixes = {key for kind, key, *_ in flagged if kind == "identifier_prefix"}
+    false_users = {key for key in users if int(key) <= honest_users}
+    false_prefixes = prefixes - {anomaly.identifier_prefix("+917777000000")}
+
+    print(f"--- {len(events):,} submits from {honest_users:,} honest users plus bots in one {anomaly.WINDOW_SECONDS}s window ---")
+    print(f"users flagged: {len(users)} ({len(false_users)} honest)")
+    print(f"identifier prefixes flagged: {len(prefixes)} ({len(false_prefixes)} honest)")
+    print(f"contestants flagged: {sum(1 for kind, *_ in flagged if kind == 'contestant')} (threshold {anomaly.CONTESTANT_FRESH_VOTES_THRESHOLD} fresh votes)")
+    ok = not false_users and not false_prefixes and str(honest_users + 1) in users and len(prefixes) == 1
+    print("OK" if ok else "FAILED: honest traffic was flagged or the bots were missed")
+    sys.exit(0 if ok else 1)
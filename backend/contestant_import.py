@@ -0,0 +1,117 @@
+# ~/idol_voting/backend/contestant_import.py
+"""
+Parsing for the bulk contestant import (POST /api/admin/contestants/import).
+
+The CSV has a header row with the ContestantCreate fields (name, age, gender, details)
+plus an optional `image` column naming a file inside the uploaded images zip. Rows are
+validated up front so a bad file is rejected as a whole, before anything is written.
+"""
+import csv
+import io
+import os
+import uuid
+import zipfile
+
+from pydantic import ValidationError
+
+import schemas
+
+MAX_IMPORT_ROWS = int(os.getenv("CONTESTANT_IMPORT_MAX_ROWS", "5000"))
+# Where images from the zip are written; served under images/ like single uploads
+CONTESTANT_IMAGE_DIR = os.getenv("CONTESTANT_IMAGE_DIR", "images")
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+MAX_CSV_BYTES = 5 * 1024 * 1024
+MAX_ZIP_BYTES = int(os.getenv("CONTESTANT_IMPORT_MAX_ZIP_MB", "500")) * 1024 * 1024
+MAX_ZIP_MEMBERS = 2 * MAX_IMPORT_ROWS
+
+
+def parse_contestant_csv(data: bytes):
+    """Returns (contestants, image filenames per row, errors); errors is a list of {row, error}."""
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return [], [], [{"row": None, "error": "CSV must be UTF-8 encoded."}]
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames or not {"name", "age", "gender"} <= {field.strip().lower() for field in reader.fieldnames}:
+        return [], [], [{"row": None, "error": "CSV header must include name, age and gender."}]
+
+    contestants, images, errors = [], [], []
+    for row_number, row in enumerate(reader, start=2):
+        if len(contestants) + len(errors) >= MAX_IMPORT_ROWS:
+            errors.append({"row": row_number, "error": f"Too many rows (at most {MAX_IMPORT_ROWS})."})
+            break
+        if None in row:
+            # csv.DictReader puts fields beyond the header in a list under the None key
+            errors.append({"row": row_number, "error": f"Row has {len(row[None])} more field(s) than the header."})
+            continue
+        row = {key.strip().lower(): (value or "").strip() for key, value in row.items()}
+        image = os.path.basename(row.pop("image", "")) or None
+        try:
+            contestant = schemas.ContestantCreate(
+                name=row.get("name"), age=row.get("age"), gender=row.get("gender"),
+                details=row.get("details") or None,
+                image_url=f"images/{image}" if image else None,
+            )
+        except ValidationError as exc:
+            errors.append({"row": row_number, "error": "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in exc.errors())})
+            continue
+        contestants.append(contestant)
+        images.append(image)
+    return contestants, images, errors
+
+
+def extract_images(archive_file, filenames: set):
+    """
+    Writes the referenced images from the zip (a seekable file, read from disk rather than
+    memory) to CONTESTANT_IMAGE_DIR. Each is stored under a new unique name, so existing
+    contestant images are never overwritten. Returns (stored filename per zip filename,
+    problems); nothing is written when there are problems.
+    """
+    size = archive_file.seek(0, os.SEEK_END)
+    archive_file.seek(0)
+    if size > MAX_ZIP_BYTES:
+        return {}, [f"the zip is larger than {MAX_ZIP_BYTES // (1024 * 1024)} MB"]
+    try:
+        archive = zipfile.ZipFile(archive_file)
+    except zipfile.BadZipFile:
+        return {}, ["not a valid zip file"]
+    with archive:
+        infos = archive.infolist()
+        if len(infos) > MAX_ZIP_MEMBERS:
+            return {}, [f"the zip has more than {MAX_ZIP_MEMBERS} entries"]
+        # Match on the bare filename so both flat zips and zips of a folder work
+        members = {os.path.basename(info.filename): info for info in infos if not info.is_dir()}
+        problems = sorted(
+            name for name in filenames
+            if name not in members or os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS or members[name].file_size > MAX_IMAGE_BYTES
+        )
+        if problems:
+            return {}, [f"{name} is missing, not an image or larger than {MAX_IMAGE_BYTES // (1024 * 1024)} MB" for name in problems]
+        os.makedirs(CONTESTANT_IMAGE_DIR, exist_ok=True)
+        stored = {}
+        try:
+            for name in sorted(filenames):
+                # Don't trust the size in the zip header: read at most one byte past the limit
+                with archive.open(members[name]) as source:
+                    content = source.read(MAX_IMAGE_BYTES + 1)
+                if len(content) > MAX_IMAGE_BYTES:
+                    remove_images(stored.values())
+                    return {}, [f"{name} is larger than {MAX_IMAGE_BYTES // (1024 * 1024)} MB"]
+                stored_name = f"{uuid.uuid4().hex[:12]}-{name}"
+                with open(os.path.join(CONTESTANT_IMAGE_DIR, stored_name), "wb") as target:
+                    target.write(content)
+                stored[name] = stored_name
+        except Exception:
+            remove_images(stored.values())
+            raise
+    return stored, []
+
+
+def remove_images(stored_names):
+    """Deletes images written by extract_images, e.g. when the import's insert failed."""
+    for stored_name in stored_names:
+        try:
+            os.remove(os.path.join(CONTESTANT_IMAGE_DIR, stored_name))
+        except FileNotFoundError:
+            pass
@@ -2,33 +2,41 @@
 import sys
 from getpass import getpass
 from sqlalchemy.orm import Session
-from database import SessionLocal, engine
+from database import SessionLocal
 import models
-import security
+import crud
 
-# Create all tables if they don't exist
-models.Base.metadata.create_all(bind=engine)
+# Tables are created by the alembic migrations (run `alembic upgrade head` first)
 
-def create_admin_user(db: Session, username: str, password: str):
-    """Creates a new admin user in the database."""
+def create_admin_user(db: Session, username: str, password: str, reset_password: bool = False):
+    """Creates a new admin user in the database, or changes the password of an existing one."""
     # Check if admin already exists
     db_admin = db.query(models.Admin).filter(models.Admin.username == username).first()
+    if db_admin and reset_password:
+        # Goes through crud so every worker drops its cached principal
+        crud.update_admin_password(db, username=username, password=password)
+        print(f"Password of admin user '{username}' changed successfully.")
+        return
     if db_admin:
-        print(f"Error: Admin with username '{username}' already exists.")
+        print(f"Error: Admin with username '{username}' already exists (use --reset-password to change its password).")
+        return
+    if reset_password:
+        print(f"Error: Admin with username '{username}' does not exist.")
         return
 
-    hashed_password = security.get_password_hash(password)
-    new_admin = models.Admin(username=username, hashed_password=hashed_password)
-    db.add(new_admin)
-    db.commit()
+    # Goes through crud so the cached admin principal is invalidated as well
+    crud.create_admin(db, username=username, password=password)
     print(f"Admin user '{username}' created successfully.")
 
 if __name__ == "__main__":
     db = SessionLocal()
     try:
-        print("--- Create Admin User ---")
+        # Usage: python create_admin.py [username] [--reset-password]
+        reset_password = "--reset-password" in sys.argv[1:]
+        args = [arg for arg in sys.argv[1:] if arg != "--reset-password"]
+        print("--- Reset Admin Password ---" if reset_password else "--- Create Admin User ---")
         # Get username from command line argument or prompt
-        admin_username = sys.argv[1] if len(sys.argv) > 1 else input("Enter admin username: ")
+        admin_username = args[0] if args else input("Enter admin username: ")
         
         # Get password securely without showing it on screen
         admin_password = getpass("Enter admin password: ")
@@ -39,6 +47,6 @@ if __name__ == "__main__":
         elif not admin_username or not admin_password:
             print("Error: Username and password cannot be empty.")
         else:
-            create_admin_user(db, username=admin_username, password=admin_password)
+            create_admin_user(db, username=admin_username, password=admin_password, reset_password=reset_password)
     finally:
         db.close()
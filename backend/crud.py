@@ -1,13 +1,27 @@
 # ~/idol_voting/backend/crud.py
 
-from sqlalchemy.orm import Session
-from sqlalchemy import update, func, desc
-from datetime import datetime, timedelta
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import update, delete, insert, select, literal, union_all, func, desc, text, case, DateTime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from datetime import datetime, timedelta, timezone
+from typing import List
+from pydantic import TypeAdapter
+import hashlib
+import json
+import logging
+import os
 import random
+import threading
+from collections import defaultdict, namedtuple
 
 import models
 import schemas
 import security
+import pubsub
+from cache import TTLCache
+
+logger = logging.getLogger("idol_voting.crud")
 
 # --- User Functions ---
 # def get_user_by_mobile(db: Session, mobile_number: str):
@@ -60,34 +74,186 @@ def create_otp(db: Session, mobile: str = None, email: str = None):
     db.add(db_otp)
     db.commit()
     db.refresh(db_otp)
-    identifier = mobile or email
-    print(f"OTP for {identifier}: {otp_code}") # For testing
+    # Sending is left to the caller (see otp_delivery.py)
     return db_otp
 
 
+# Wrong codes allowed per OTP before it is locked and a new one has to be requested
+OTP_MAX_ATTEMPTS = int(os.getenv("OTP_MAX_ATTEMPTS", "5"))
+
 def verify_otp(db: Session, otp_code: str, mobile: str = None, email: str = None):
-    """Verifies the provided OTP for a given identifier."""
-    query = db.query(models.OTP).filter(
-        models.OTP.otp_code == otp_code,
-        models.OTP.is_used == False,
-        models.OTP.expiry_timestamp > datetime.utcnow()
-    )
+    """Verifies the provided OTP for a given identifier. Returns the consumed OTP's ID or None."""
+    otp_id = _consume_otp(db, otp_code, mobile=mobile, email=email)
+    db.commit()  # also keeps the failed attempt, if any
+    return otp_id
+
+def _consume_otp(db: Session, otp_code: str, mobile: str = None, email: str = None):
+    # One conditional UPDATE ... RETURNING on the identifier's newest unexpired OTP: a matching
+    # code marks it used, a wrong one counts a failed attempt. The row lock makes concurrent
+    # verifies re-check is_used / failed_attempts, so a code is consumed at most once.
+    # Returns the OTP's ID if it was consumed; the caller commits either way.
+    newest = select(models.OTP.id).where(models.OTP.expiry_timestamp > datetime.utcnow())
     if mobile:
-        query = query.filter(models.OTP.mobile_number == mobile)
+        newest = newest.where(models.OTP.mobile_number == mobile)
     if email:
-        query = query.filter(models.OTP.email == email)
-    
-    db_otp = query.order_by(models.OTP.created_at.desc()).first()
-    if not db_otp:
+        newest = newest.where(models.OTP.email == email)
+    newest = newest.order_by(models.OTP.created_at.desc(), models.OTP.id.desc()).limit(1).scalar_subquery()
+    matches = models.OTP.otp_code == otp_code
+    row = db.execute(
+        update(models.OTP)
+        .where(models.OTP.id == newest, models.OTP.is_used == False, models.OTP.failed_attempts < OTP_MAX_ATTEMPTS)
+        .values(is_used=matches, failed_attempts=models.OTP.failed_attempts + case((matches, 0), else_=1))
+        .returning(models.OTP.id, models.OTP.is_used)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is None or not row.is_used:
         return None
-    db_otp.is_used = True
+    return row.id
+
+def upsert_user(db: Session, mobile: str = None, email: str = None) -> int:
+    """Returns the ID of the user with this identifier, creating the user if needed. Does not commit."""
+    # The no-op DO UPDATE makes RETURNING yield the existing row too, and a concurrent first
+    # login of the same identifier waits for the other insert and then gets its user.
+    column = models.User.mobile_number if mobile else models.User.email
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(models.User).values(mobile_number=mobile, email=email)
+    return db.execute(stmt.on_conflict_do_update(
+        index_elements=[column],
+        set_={column.key: getattr(stmt.excluded, column.key)}
+    ).returning(models.User.id)).scalar_one()
+
+def login_with_otp(db: Session, otp_code: str, mobile: str = None, email: str = None):
+    """Consumes the OTP, gets or creates the user and starts a refresh token family in one
+    transaction. Returns (user_id, refresh_token), or None if the OTP is invalid or expired."""
+    if not (mobile or email):
+        return None
+    if _consume_otp(db, otp_code, mobile=mobile, email=email) is None:
+        db.commit()  # keep the failed attempt
+        return None
+    user_id = upsert_user(db, mobile=mobile, email=email)
+    refresh_token = create_refresh_token(db, user_id)
     db.commit()
-    db.refresh(db_otp)
-    return db_otp
+    return user_id, refresh_token
+
+# --- Refresh Token Functions (HIGHLIGHT: New section) ---
+# A refresh renews the access token with one conditional UPDATE on the family row instead of
+# another send-otp/verify-otp round trip. Every refresh rotates the secret; a secret that was
+# already rotated away means the token was copied or replayed, so the whole family is revoked
+# and the user has to log in with an OTP again. Clients must not refresh concurrently.
+_last_refresh_family_purge = 0.0
+
+def create_refresh_token(db: Session, user_id: int) -> str:
+    """Adds a new token family to the current transaction and returns its first refresh token; the caller commits."""
+    _purge_expired_refresh_token_families(db)
+    family_id, secret = security.new_refresh_family_id(), security.new_refresh_secret()
+    db.add(models.RefreshTokenFamily(
+        id=family_id,
+        user_id=user_id,
+        token_hash=security.hash_refresh_secret(secret),
+        generation=0,
+        expires_at=datetime.now(timezone.utc) + timedelta(days=security.REFRESH_TOKEN_EXPIRE_DAYS)
+    ))
+    return f"{family_id}.{secret}"
+
+def rotate_refresh_token(db: Session, token: str):
+    """Swaps a refresh token for the next one of its family. Returns (user_id, new token), or None."""
+    parts = security.split_refresh_token(token)
+    if parts is None:
+        return None
+    family_id, secret = parts
+    family = models.RefreshTokenFamily
+    now = datetime.now(timezone.utc)
+    new_secret = security.new_refresh_secret()
+    user_id = db.execute(
+        update(family)
+        .where(family.id == family_id, family.token_hash == security.hash_refresh_secret(secret), family.revoked_at.is_(None), family.expires_at > now)
+        .values(token_hash=security.hash_refresh_secret(new_secret), generation=family.generation + 1, updated_at=now)
+        .returning(family.user_id)
+    ).scalar()
+    if user_id is None:
+        # Unknown, expired or revoked family, or a reused secret: make sure the family is dead
+        db.execute(update(family).where(family.id == family_id, family.revoked_at.is_(None)).values(revoked_at=now))
+        db.commit()
+        return None
+    db.commit()
+    return user_id, f"{family_id}.{new_secret}"
+
+def revoke_refresh_token(db: Session, token: str) -> bool:
+    """Revokes the family of a current refresh token (logout). Returns False if the token is not current."""
+    parts = security.split_refresh_token(token)
+    if parts is None:
+        return False
+    family_id, secret = parts
+    family = models.RefreshTokenFamily
+    revoked = db.execute(
+        update(family)
+        .where(family.id == family_id, family.token_hash == security.hash_refresh_secret(secret), family.revoked_at.is_(None))
+        .values(revoked_at=datetime.now(timezone.utc))
+    ).rowcount
+    db.commit()
+    return revoked > 0
+
+def _purge_expired_refresh_token_families(db: Session):
+    # Keeps the table bounded; runs at most once a minute per worker.
+    global _last_refresh_family_purge
+    now = datetime.now(timezone.utc)
+    if now.timestamp() - _last_refresh_family_purge < 60:
+        return
+    _last_refresh_family_purge = now.timestamp()
+    db.execute(delete(models.RefreshTokenFamily).where(models.RefreshTokenFamily.expires_at <= now))
 
 # --- Admin Functions ---
+# Admin accounts almost never change, so every worker keeps a small cache of admin
+# principals for authenticating admin tokens. Writes evict the entry here and, through
+# pubsub, in every other worker; the TTL only matters if a notification is missed. The
+# password hash is never cached: admin logins always check it against the database.
+ADMIN_CACHE_TTL_SECONDS = int(os.getenv("ADMIN_CACHE_TTL_SECONDS", "60"))
+admin_cache = TTLCache(maxsize=64, ttl=ADMIN_CACHE_TTL_SECONDS)
+
+AdminPrincipal = namedtuple("AdminPrincipal", "id username")
+
 def get_admin_by_username(db: Session, username: str):
-    return db.query(models.Admin).filter(models.Admin.username == username).first()
+    """Fetches an admin's principal by username, served from the admin cache when possible."""
+    admin = admin_cache.get(username)
+    if admin is not None:
+        return admin
+    row = db.query(models.Admin.id, models.Admin.username).filter(models.Admin.username == username).first()
+    if row is None:
+        return None
+    admin = AdminPrincipal(row.id, row.username)
+    admin_cache.set(username, admin)
+    return admin
+
+def authenticate_admin(db: Session, username: str, password: str):
+    """Returns the admin's principal if the password matches the stored hash, else None."""
+    row = db.query(models.Admin.id, models.Admin.username, models.Admin.hashed_password).filter(models.Admin.username == username).first()
+    if row is None or not security.verify_password(password, row.hashed_password):
+        return None
+    return AdminPrincipal(row.id, row.username)
+
+def invalidate_admin(username: str = None):
+    """Drops one cached admin (or all of them when no username is given)."""
+    if username is None:
+        admin_cache.clear()
+    else:
+        admin_cache.pop(username)
+
+def create_admin(db: Session, username: str, password: str):
+    """Creates a new admin user with a hashed password."""
+    db_admin = models.Admin(username=username, hashed_password=security.get_password_hash(password))
+    db.add(db_admin)
+    pubsub.publish(db, "admin", username)
+    db.commit()
+    db.refresh(db_admin)
+    invalidate_admin(username)
+    return db_admin
+
+def update_admin_password(db: Session, username: str, password: str):
+    """Changes an admin's password and evicts the cached principal."""
+    db.execute(update(models.Admin).where(models.Admin.username == username).values(hashed_password=security.get_password_hash(password)))
+    pubsub.publish(db, "admin", username)
+    db.commit()
+    invalidate_admin(username)
 
 # --- Contestant Functions ---
 def get_contestants(db: Session, skip: int = 0, limit: int = 100):
@@ -95,10 +261,26 @@ def get_contestants(db: Session, skip: int = 0, limit: int = 100):
 def create_contestant(db: Session, contestant: schemas.ContestantCreate):
     db_contestant = models.Contestant(**contestant.model_dump())
     db.add(db_contestant)
+    db.flush()
+    pubsub.publish(db, "contestant", db_contestant.id)
     db.commit()
     db.refresh(db_contestant)
     return db_contestant
 
+# Rows per INSERT statement in bulk imports
+CONTESTANT_IMPORT_BATCH_SIZE = 500
+
+def create_contestants(db: Session, contestants: list) -> list:
+    """Inserts contestants in batched statements within one transaction and returns their IDs."""
+    rows = [contestant.model_dump() for contestant in contestants]
+    ids = []
+    for start in range(0, len(rows), CONTESTANT_IMPORT_BATCH_SIZE):
+        batch = rows[start:start + CONTESTANT_IMPORT_BATCH_SIZE]
+        ids.extend(db.scalars(insert(models.Contestant).returning(models.Contestant.id, sort_by_parameter_order=True), batch).all())
+    pubsub.publish(db, "contestant")
+    db.commit()
+    return ids
+
 # --- Voting Line Functions ---
 def get_voting_lines(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.VotingLine).order_by(models.VotingLine.created_at.desc()).offset(skip).limit(limit).all()
@@ -117,33 +299,587 @@ def create_voting_line(db: Session, voting_line: schemas.VotingLineCreate):
         db_voting_line.contestants.extend(contestants)
         
     db.add(db_voting_line)
+    db.flush()
+    pubsub.publish(db, "voting_line", db_voting_line.id)
     db.commit()
     db.refresh(db_voting_line)
+    invalidate_voting_line(db_voting_line.id)
     return db_voting_line
 def update_voting_line_status(db: Session, line_id: int, is_active: bool):
-    if is_active:
-        db.execute(update(models.VotingLine).values(is_active=False))
-    db.execute(update(models.VotingLine).where(models.VotingLine.id == line_id).values(is_active=is_active))
+    # HIGHLIGHT: Several lines can be active at once, so other lines are left untouched
+    db.execute(update(models.VotingLine).where(models.VotingLine.id == line_id).values(is_active=is_active, status_changed_at=datetime.now(timezone.utc)))
+    pubsub.publish(db, "voting_line", line_id)
     db.commit()
+    invalidate_voting_line(line_id)
     return db.query(models.VotingLine).filter(models.VotingLine.id == line_id).first()
 
 # --- Voting Functions ---
-def get_active_voting_line(db: Session):
-    now = datetime.now(datetime.utcnow().astimezone().tzinfo)
-    return db.query(models.VotingLine).filter(models.VotingLine.is_active == True, models.VotingLine.start_time <= now, models.VotingLine.end_time >= now).first()
+# Each worker caches every voting line it serves (with its contestants and quota) as a
+# schemas.VotingLine, plus the set of its contestant IDs, so vote requests for a given line
+# are O(1) dictionary lookups no matter how many lines are open. Writes evict the line here
+# and, through pubsub, in the other workers; the short TTLs are a safety net.
+VOTING_LINE_CACHE_TTL_SECONDS = int(os.getenv("VOTING_LINE_CACHE_TTL_SECONDS", "10"))
+voting_line_cache = TTLCache(maxsize=256, ttl=VOTING_LINE_CACHE_TTL_SECONDS)
+line_contestants_cache = TTLCache(maxsize=256, ttl=VOTING_LINE_CACHE_TTL_SECONDS)
+active_lines_cache = TTLCache(maxsize=1, ttl=min(VOTING_LINE_CACHE_TTL_SECONDS, 5))
+
+def invalidate_voting_line(line_id: int = None):
+    """Evicts one cached line (or all of them) along with the list of active lines and its leaderboard and results."""
+    if line_id is None:
+        voting_line_cache.clear()
+        line_contestants_cache.clear()
+        leaderboard_cache.clear()
+        results_cache.clear()
+    else:
+        voting_line_cache.pop(line_id)
+        line_contestants_cache.pop(line_id)
+        leaderboard_cache.pop(line_id)
+        results_cache.pop(line_id)
+    active_lines_cache.clear()
+
+# Evict entries when another worker (or create_admin.py) changes them
+pubsub.subscribe("admin", invalidate_admin)
+pubsub.subscribe("voting_line", invalidate_voting_line)
+pubsub.subscribe("contestant", lambda contestant_id: invalidate_voting_line())
+
+def get_cached_voting_line(db: Session, line_id: int):
+    """Returns the voting line with its contestants as a schemas.VotingLine, or None."""
+    line = voting_line_cache.get(line_id)
+    if line is None:
+        db_line = db.query(models.VotingLine).options(selectinload(models.VotingLine.contestants)).filter(models.VotingLine.id == line_id).first()
+        if db_line is None:
+            return None
+        line = schemas.VotingLine.model_validate(db_line)
+        voting_line_cache.set(line_id, line)
+        line_contestants_cache.set(line_id, frozenset(c.id for c in line.contestants))
+    return line
+
+def get_line_contestant_ids(db: Session, voting_line_id: int) -> frozenset:
+    """Returns the set of contestant IDs on a voting line (cached per worker)."""
+    contestant_ids = line_contestants_cache.get(voting_line_id)
+    if contestant_ids is None:
+        line = get_cached_voting_line(db, voting_line_id)
+        contestant_ids = frozenset(c.id for c in line.contestants) if line else frozenset()
+        line_contestants_cache.set(voting_line_id, contestant_ids)
+    return contestant_ids
+
+# The /api/vote/state body is identical for every user except user_total_votes, so its JSON
+# is rendered once per cached line object (i.e. per line version) and reused.
+voting_page_cache = TTLCache(maxsize=256, ttl=VOTING_LINE_CACHE_TTL_SECONDS)
+_contestant_list = TypeAdapter(List[schemas.Contestant])
+
+def get_voting_page_prefix(line: schemas.VotingLine) -> bytes:
+    """JSON of a schemas.PublicVotingPage up to the user_total_votes value (to be followed by `<n>}`)."""
+    cached = voting_page_cache.get(line.id)
+    if cached is not None and cached[0] is line:
+        return cached[1]
+    prefix = b'{"voting_line":' + line.model_dump_json().encode() + b',"contestants":' + _contestant_list.dump_json(line.contestants) + b',"user_total_votes":'
+    voting_page_cache.set(line.id, (line, prefix))
+    return prefix
+
+def _as_utc(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes; Postgres returns aware ones
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+def get_voting_line_schedule(db: Session, now: datetime) -> list:
+    """(id, start_time, end_time, is_active) of every line that has not ended yet, earliest start first."""
+    rows = db.query(models.VotingLine.id, models.VotingLine.start_time, models.VotingLine.end_time, models.VotingLine.is_active).filter(models.VotingLine.end_time >= now).order_by(models.VotingLine.start_time, models.VotingLine.id).all()
+    return [(row.id, _as_utc(row.start_time), _as_utc(row.end_time), bool(row.is_active)) for row in rows]
+
+def apply_voting_line_schedule(db: Session, now: datetime) -> list:
+    """
+    Closes active lines whose end_time has passed and opens inactive lines whose window
+    contains now, unless their status was ever set before (an admin deactivating a line,
+    before or after its start, cancels it; the scheduler's own open and close count too).
+    Being state-based rather than tied to boundary crossings, this also
+    catches up on boundaries that passed while no worker was running and on lines created
+    with a start_time in the past. The updates are conditional on is_active, so when every
+    worker runs them at the same boundary only one of them actually changes each row.
+    Returns the changed line IDs.
+    """
+    line = models.VotingLine
+    closed = db.execute(update(line).where(line.is_active == True, line.end_time < now).values(is_active=False, status_changed_at=now).returning(line.id)).scalars().all()
+    opened = db.execute(update(line).where(
+        line.is_active == False, line.start_time <= now, line.end_time >= now, line.status_changed_at == None
+    ).values(is_active=True, status_changed_at=now).returning(line.id)).scalars().all()
+    for line_id in closed + opened:
+        pubsub.publish(db, "voting_line", line_id)
+    db.commit()
+    for line_id in closed + opened:
+        invalidate_voting_line(line_id)
+    return closed + opened
+
+def get_open_line_windows(db: Session) -> dict:
+    """line_id -> (start_time, end_time) of active lines, as the scheduler tracks them in memory."""
+    windows = active_lines_cache.get("active")
+    if windows is None:
+        now = datetime.now(timezone.utc)
+        windows = {line_id: (start, end) for line_id, start, end, is_active in get_voting_line_schedule(db, now) if is_active}
+        active_lines_cache.set("active", windows)
+    return windows
+
+def _is_open(window: tuple, now: datetime) -> bool:
+    return window is not None and window[0] <= now <= window[1]
+
+def get_active_voting_lines(db: Session, open_lines: dict = None) -> list:
+    """All lines open for voting. `open_lines` is the scheduler's in-memory state; loaded from the DB if not given."""
+    open_lines = get_open_line_windows(db) if open_lines is None else open_lines
+    now = datetime.now(timezone.utc)
+    lines = (get_cached_voting_line(db, line_id) for line_id, window in open_lines.items() if _is_open(window, now))
+    return [line for line in lines if line is not None]
+
+def get_active_voting_line(db: Session, line_id: int = None, open_lines: dict = None):
+    """
+    Returns the requested line if it is open for voting. Without a line_id, falls back to
+    the earliest open line (clients written before lines could run in parallel).
+    """
+    open_lines = get_open_line_windows(db) if open_lines is None else open_lines
+    if line_id is None:
+        now = datetime.now(timezone.utc)
+        line_id = next((open_id for open_id, window in open_lines.items() if _is_open(window, now)), None)
+        if line_id is None:
+            return None
+    elif not _is_open(open_lines.get(line_id), datetime.now(timezone.utc)):
+        return None
+    return get_cached_voting_line(db, line_id)
+
 def get_user_votes_for_line(db: Session, user_id: int, voting_line_id: int):
     total_votes = db.query(func.sum(models.Vote.vote_count)).filter(models.Vote.user_id == user_id, models.Vote.voting_line_id == voting_line_id).scalar()
     return total_votes or 0
-def submit_votes(db: Session, user_id: int, voting_line_id: int, votes: dict):
-    for contestant_id, vote_count in votes.items():
-        if vote_count > 0:
-            db_vote = models.Vote(user_id=user_id, contestant_id=int(contestant_id), voting_line_id=voting_line_id, vote_count=vote_count)
-            db.add(db_vote)
+# Outcomes of submit_votes
+VOTES_ACCEPTED = "accepted"
+VOTES_REJECTED = "rejected"
+VOTES_REPLAYED = "replayed"
+
+def submit_votes(db: Session, user_id: int, voting_line_id: int, votes: dict, max_votes: int, idempotency_key: str = None, response: dict = None):
+    """
+    Inserts the votes only if they keep the user within `max_votes` for the line.
+
+    The user's row is locked first so concurrent submits for the same user are serialized,
+    then a single conditional INSERT ... SELECT checks the quota and inserts in one statement.
+    Returns VOTES_ACCEPTED or VOTES_REJECTED, or VOTES_REPLAYED when another request already
+    committed the same idempotency key (nothing is inserted in that case).
+    """
+    rows = [(int(contestant_id), vote_count) for contestant_id, vote_count in votes.items() if vote_count > 0]
+    total_new_votes = sum(vote_count for _, vote_count in rows)
+    if not rows:
+        return VOTES_REJECTED
+
+    db.query(models.User.id).filter(models.User.id == user_id).with_for_update().one()
+    # Set here rather than by the server default so the aggregates bucket the votes exactly
+    # like the votes table does (see reconcile_vote_aggregates)
+    now = datetime.now(timezone.utc)
+    votes_cast = select(func.coalesce(func.sum(models.Vote.vote_count), 0)).where(
+        models.Vote.user_id == user_id, models.Vote.voting_line_id == voting_line_id
+    ).scalar_subquery()
+    within_quota = votes_cast + total_new_votes <= max_votes
+    selects = [
+        select(literal(user_id), literal(contestant_id), literal(voting_line_id), literal(vote_count), literal(now, DateTime(timezone=True))).where(within_quota)
+        for contestant_id, vote_count in rows
+    ]
+    result = db.execute(insert(models.Vote).from_select(
+        ["user_id", "contestant_id", "voting_line_id", "vote_count", "created_at"],
+        selects[0] if len(selects) == 1 else union_all(*selects)
+    ))
+    if result.rowcount == 0:
+        db.rollback()
+        return VOTES_REJECTED
+
+    if idempotency_key and not save_idempotent_response(db, user_id=user_id, key=idempotency_key, response=response):
+        # Another request committed the same key after our lookup
+        db.rollback()
+        return VOTES_REPLAYED
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        if idempotency_key and get_idempotent_response(db, user_id=user_id, key=idempotency_key) is not None:
+            return VOTES_REPLAYED
+        raise
+    vote_aggregates.add(voting_line_id, rows, now)
+    if idempotency_key:
+        idempotency_cache.set((user_id, idempotency_key), (200, response))
+    return VOTES_ACCEPTED
+
+def _upsert(db: Session, table):
+    # INSERT ... ON CONFLICT is dialect specific in SQLAlchemy
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(table)
+
+# --- Buffered Vote Aggregates ---
+# voting_line_tallies and vote_rollups_minute are hot rows (one per contestant, and per
+# contestant and minute), so submit_votes doesn't touch them inside its transaction: that
+# would make every concurrent submit for a contestant wait on the same row lock until commit.
+# Instead each worker adds accepted votes to an in-memory buffer and flush_vote_aggregates
+# (every AGGREGATE_FLUSH_SECONDS, from scheduler.py) writes the summed deltas with one upsert
+# per table, so each row is locked once per flush per worker. Deltas of a worker killed
+# between flushes are lost from the aggregates (never from votes); reconcile_vote_aggregates
+# puts them back from the votes table once their minute has settled.
+AGGREGATE_FLUSH_SECONDS = float(os.getenv("AGGREGATE_FLUSH_SECONDS", "1"))
+# Minutes older than this are owned by reconcile_vote_aggregates; the flusher drops buffered
+# deltas older than half of it (the reconciler counts those from the votes instead)
+AGGREGATE_SETTLE_SECONDS = int(os.getenv("AGGREGATE_SETTLE_SECONDS", "120"))
+AGGREGATE_RECONCILE_MINUTES = int(os.getenv("AGGREGATE_RECONCILE_MINUTES", "60"))
+AGGREGATE_RECONCILE_LOCK_ID = 7303
+
+class VoteAggregateBuffer:
+    """Pending (voting_line_id, contestant_id, minute) -> votes deltas; tallies are their sums."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rollups = defaultdict(int)
+
+    def add(self, voting_line_id: int, rows: list, now: datetime):
+        bucket_start = _minute_bucket(now)
+        with self._lock:
+            for contestant_id, vote_count in rows:
+                self._rollups[(voting_line_id, contestant_id, bucket_start)] += vote_count
+
+    def take(self) -> dict:
+        """Returns and clears the pending deltas."""
+        with self._lock:
+            pending, self._rollups = self._rollups, defaultdict(int)
+        return pending
+
+    def restore(self, rollups: dict):
+        """Puts back deltas whose flush failed."""
+        with self._lock:
+            for key, votes in rollups.items():
+                self._rollups[key] += votes
+
+vote_aggregates = VoteAggregateBuffer()
+
+def flush_vote_aggregates(db: Session, now: datetime = None) -> int:
+    """Writes this worker's buffered tally and rollup deltas; returns the tally rows touched."""
+    cutoff = _minute_bucket((now or datetime.now(timezone.utc)) - timedelta(seconds=AGGREGATE_SETTLE_SECONDS / 2))
+    rollups = {key: votes for key, votes in vote_aggregates.take().items() if key[2] >= cutoff}
+    if not rollups:
+        return 0
+    tallies = defaultdict(int)
+    for (voting_line_id, contestant_id, _), votes in rollups.items():
+        tallies[(voting_line_id, contestant_id)] += votes
+    try:
+        _add_to_tallies(db, tallies)
+        _add_to_rollups(db, rollups)
+        db.commit()
+    except Exception:
+        db.rollback()
+        vote_aggregates.restore(rollups)
+        raise
+    return len(tallies)
+
+def _vote_minute(db: Session):
+    if db.get_bind().dialect.name == "postgresql":
+        return func.date_trunc("minute", models.Vote.created_at)
+    return func.strftime("%Y-%m-%d %H:%M:00", models.Vote.created_at)
+
+def reconcile_vote_aggregates(db: Session, now: datetime = None) -> int:
+    """
+    Compares the minute rollups of the last AGGREGATE_RECONCILE_MINUTES settled minutes with the
+    votes table and adds any difference to the rollups and tallies; returns the votes corrected.
+    Tallies and minute rollups are flushed in the same transaction, so a minute that matches
+    its votes means the tallies hold those votes too.
+    """
+    now = now or datetime.now(timezone.utc)
+    until = _minute_bucket(now - timedelta(seconds=AGGREGATE_SETTLE_SECONDS))
+    since = until - timedelta(minutes=AGGREGATE_RECONCILE_MINUTES)
+    if db.get_bind().dialect.name == "postgresql":
+        # Every worker runs this; the advisory lock makes sure only one reconciles at a time
+        if not db.execute(text("SELECT pg_try_advisory_xact_lock(:lock_id)"), {"lock_id": AGGREGATE_RECONCILE_LOCK_ID}).scalar():
+            db.rollback()
+            return 0
+    minute = _vote_minute(db)
+    drift = defaultdict(int)
+    for row in db.query(models.Vote.voting_line_id, models.Vote.contestant_id, minute, func.sum(models.Vote.vote_count)).filter(
+        models.Vote.created_at >= since, models.Vote.created_at < until
+    ).group_by(models.Vote.voting_line_id, models.Vote.contestant_id, minute).all():
+        bucket_start = row[2] if isinstance(row[2], datetime) else datetime.fromisoformat(row[2])
+        drift[(row[0], row[1], _as_utc(bucket_start))] += int(row[3])
+    for row in db.query(models.VoteRollupMinute).filter(models.VoteRollupMinute.bucket_start >= since, models.VoteRollupMinute.bucket_start < until).all():
+        drift[(row.voting_line_id, row.contestant_id, _as_utc(row.bucket_start))] -= row.votes
+    drift = {key: votes for key, votes in drift.items() if votes}
+    if not drift:
+        db.rollback()
+        return 0
+    tallies = defaultdict(int)
+    for (voting_line_id, contestant_id, _), votes in drift.items():
+        tallies[(voting_line_id, contestant_id)] += votes
+    _add_to_tallies(db, tallies)
+    _add_to_rollups(db, drift)
+    db.commit()
+    logger.warning("Reconciled vote aggregates: %d minute buckets were off by %d votes in total", len(drift), sum(drift.values()))
+    return sum(abs(votes) for votes in drift.values())
+
+def _add_to_tallies(db: Session, tallies: dict):
+    # Sorted so concurrent flushes lock the tally rows in the same order (no deadlocks)
+    stmt = _upsert(db, models.VotingLineTally).values([
+        {"voting_line_id": voting_line_id, "contestant_id": contestant_id, "total_votes": vote_count}
+        for (voting_line_id, contestant_id), vote_count in sorted(tallies.items())
+    ])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["voting_line_id", "contestant_id"],
+        set_={"total_votes": models.VotingLineTally.total_votes + stmt.excluded.total_votes, "updated_at": func.now()}
+    ))
+
+# --- Vote Rate Rollups (HIGHLIGHT: New section) ---
+# Minute buckets are kept for ROLLUP_MINUTE_RETENTION_HOURS, then folded into hourly buckets
+# by compact_vote_rollups (run periodically from every worker; only one does the work).
+ROLLUP_MINUTE_RETENTION_HOURS = int(os.getenv("ROLLUP_MINUTE_RETENTION_HOURS", "48"))
+ROLLUP_COMPACTION_LOCK_ID = 7301
+
+def _minute_bucket(value: datetime) -> datetime:
+    return _as_utc(value).replace(second=0, microsecond=0)
+
+def _hour_bucket(value: datetime) -> datetime:
+    return _as_utc(value).replace(minute=0, second=0, microsecond=0)
+
+def _add_to_rollups(db: Session, rollups: dict):
+    stmt = _upsert(db, models.VoteRollupMinute).values([
+        {"voting_line_id": voting_line_id, "contestant_id": contestant_id, "bucket_start": bucket_start, "votes": vote_count}
+        for (voting_line_id, contestant_id, bucket_start), vote_count in sorted(rollups.items())
+    ])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["voting_line_id", "contestant_id", "bucket_start"],
+        set_={"votes": models.VoteRollupMinute.votes + stmt.excluded.votes}
+    ))
+
+def compact_vote_rollups(db: Session, now: datetime = None) -> int:
+    """Moves whole hours of minute rollups older than the retention window into hourly rollups."""
+    now = now or datetime.now(timezone.utc)
+    cutoff = _hour_bucket(now - timedelta(hours=ROLLUP_MINUTE_RETENTION_HOURS))
+    if db.get_bind().dialect.name == "postgresql":
+        # Every worker runs this; the advisory lock makes sure only one compacts at a time
+        if not db.execute(text("SELECT pg_try_advisory_xact_lock(:lock_id)"), {"lock_id": ROLLUP_COMPACTION_LOCK_ID}).scalar():
+            db.rollback()
+            return 0
+    minute_rows = db.query(models.VoteRollupMinute).filter(models.VoteRollupMinute.bucket_start < cutoff).all()
+    if not minute_rows:
+        db.rollback()
+        return 0
+    hourly = defaultdict(int)
+    for row in minute_rows:
+        hourly[(row.voting_line_id, row.contestant_id, _hour_bucket(row.bucket_start))] += row.votes
+    stmt = _upsert(db, models.VoteRollupHour).values([
+        {"voting_line_id": line_id, "contestant_id": contestant_id, "bucket_start": bucket_start, "votes": votes}
+        for (line_id, contestant_id, bucket_start), votes in sorted(hourly.items())
+    ])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=["voting_line_id", "contestant_id", "bucket_start"],
+        set_={"votes": models.VoteRollupHour.votes + stmt.excluded.votes}
+    ))
+    db.execute(delete(models.VoteRollupMinute).where(models.VoteRollupMinute.bucket_start < cutoff).execution_options(synchronize_session=False))
+    db.commit()
+    return len(minute_rows)
+
+def get_vote_rate_series(db: Session, voting_line_id: int, resolution: str, since: datetime, until: datetime, contestant_id: int = None) -> list:
+    """Votes per contestant per minute or hour in [since, until), oldest first."""
+    def rollup_rows(model):
+        query = db.query(model.contestant_id, model.bucket_start, model.votes).filter(model.voting_line_id == voting_line_id, model.bucket_start >= since, model.bucket_start < until)
+        if contestant_id is not None:
+            query = query.filter(model.contestant_id == contestant_id)
+        return query.all()
+
+    points = defaultdict(int)
+    if resolution == "minute":
+        for row in rollup_rows(models.VoteRollupMinute):
+            points[(_as_utc(row.bucket_start), row.contestant_id)] += row.votes
+    else:
+        # Recent hours still live in the minute table until they are compacted
+        for row in rollup_rows(models.VoteRollupHour):
+            points[(_as_utc(row.bucket_start), row.contestant_id)] += row.votes
+        for row in rollup_rows(models.VoteRollupMinute):
+            points[(_hour_bucket(row.bucket_start), row.contestant_id)] += row.votes
+    return [
+        {"bucket_start": bucket_start, "contestant_id": point_contestant_id, "votes": votes}
+        for (bucket_start, point_contestant_id), votes in sorted(points.items())
+    ]
+
+# --- Vote Anomaly Functions (HIGHLIGHT: New section) ---
+def record_vote_anomalies(db: Session, anomalies: list):
+    db.execute(insert(models.VoteAnomaly), anomalies)
+    db.commit()
+
+def get_vote_anomalies(db: Session, voting_line_id: int = None, limit: int = 100):
+    query = db.query(models.VoteAnomaly)
+    if voting_line_id is not None:
+        query = query.filter(models.VoteAnomaly.voting_line_id == voting_line_id)
+    return query.order_by(models.VoteAnomaly.detected_at.desc()).limit(limit).all()
+
+# --- Leaderboard Functions (HIGHLIGHT: New section) ---
+# Built from voting_line_tallies (one row per contestant) rather than by aggregating votes,
+# and served from memory; a response is at most LEADERBOARD_MAX_AGE_SECONDS plus
+# AGGREGATE_FLUSH_SECONDS behind the votes.
+LEADERBOARD_MAX_AGE_SECONDS = float(os.getenv("LEADERBOARD_MAX_AGE_SECONDS", "2"))
+leaderboard_cache = TTLCache(maxsize=256, ttl=LEADERBOARD_MAX_AGE_SECONDS)
+
+def get_line_tallies(db: Session, voting_line_id: int) -> dict:
+    """contestant_id -> total votes for a line."""
+    rows = db.query(models.VotingLineTally.contestant_id, models.VotingLineTally.total_votes).filter(models.VotingLineTally.voting_line_id == voting_line_id).all()
+    return {row.contestant_id: row.total_votes for row in rows}
+
+def _rank_contestants(counts) -> list:
+    """Ranks (votes, contestant_id, name) tuples, most votes first; ties share a rank ("1, 2, 2, 4")."""
+    entries, rank = [], 0
+    for position, (votes, contestant_id, name) in enumerate(sorted(counts, key=lambda entry: (-entry[0], entry[1])), start=1):
+        if not entries or votes != entries[-1]["total_votes"]:
+            rank = position
+        entries.append({"rank": rank, "contestant_id": contestant_id, "contestant_name": name, "total_votes": votes})
+    return entries
+
+def get_leaderboard(db: Session, voting_line_id: int, top_k: int):
+    """Top-K contestants of a line with rank and vote share, or None if the line does not exist."""
+    board = leaderboard_cache.get(voting_line_id)
+    if board is None:
+        line = get_cached_voting_line(db, voting_line_id)
+        if line is None:
+            return None
+        tallies = get_line_tallies(db, voting_line_id)
+        total = sum(tallies.values())
+        entries = _rank_contestants((tallies.get(c.id, 0), c.id, c.name) for c in line.contestants)
+        for entry in entries:
+            entry["vote_share"] = entry["total_votes"] / total if total else 0.0
+        board = {"voting_line_id": voting_line_id, "voting_line_name": line.name, "total_votes": total, "entries": entries, "generated_at": datetime.now(timezone.utc)}
+        leaderboard_cache.set(voting_line_id, board)
+    return {**board, "entries": board["entries"][:top_k]}
+
+# --- Result Snapshot Functions (HIGHLIGHT: New section) ---
+# Once a line's end_time has passed its results can't change, so they are aggregated from the
+# raw votes once, stored in voting_line_results and served from there (and from memory).
+# Long enough for journaled submits (journal.py) to be replayed: segments rotate every 30s
+# and are replayed within 5s. Replays that still arrive later are rejected, not counted.
+RESULTS_FINALIZE_GRACE_SECONDS = int(os.getenv("RESULTS_FINALIZE_GRACE_SECONDS", "60"))
+RESULTS_FINALIZE_LOCK_ID = 7302
+results_cache = TTLCache(maxsize=256, ttl=3600)
+
+def _aggregate_line_votes(db: Session, voting_line_id: int):
+    """(contestant_id -> votes, unique voters) straight from the votes table."""
+    rows = db.query(models.Vote.contestant_id, func.sum(models.Vote.vote_count)).filter(models.Vote.voting_line_id == voting_line_id).group_by(models.Vote.contestant_id).all()
+    unique_voters = db.query(func.count(func.distinct(models.Vote.user_id))).filter(models.Vote.voting_line_id == voting_line_id).scalar()
+    return {contestant_id: int(votes or 0) for contestant_id, votes in rows}, unique_voters
+
+def _results_checksum(voting_line_id: int, counts: dict, unique_voters: int) -> str:
+    payload = json.dumps({"voting_line_id": voting_line_id, "unique_voters": unique_voters, "votes": sorted(counts.items())}, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def finalize_closed_voting_lines(db: Session, now: datetime = None) -> list:
+    """Snapshots the results of every line that ended (plus a grace period) and has none yet."""
+    now = now or datetime.now(timezone.utc)
+    if db.get_bind().dialect.name == "postgresql":
+        # Every worker runs this; the advisory lock makes sure each line is finalized once
+        if not db.execute(text("SELECT pg_try_advisory_xact_lock(:lock_id)"), {"lock_id": RESULTS_FINALIZE_LOCK_ID}).scalar():
+            db.rollback()
+            return []
+    lines = db.query(models.VotingLine).options(selectinload(models.VotingLine.contestants)).outerjoin(
+        models.VotingLineResult, models.VotingLineResult.voting_line_id == models.VotingLine.id
+    ).filter(
+        models.VotingLineResult.voting_line_id.is_(None),
+        models.VotingLine.end_time < now - timedelta(seconds=RESULTS_FINALIZE_GRACE_SECONDS)
+    ).with_for_update(of=models.VotingLine).all()  # waits for in-flight journal replays of these lines
+    for line in lines:
+        counts, unique_voters = _aggregate_line_votes(db, line.id)
+        names = {contestant.id: contestant.name for contestant in line.contestants}
+        missing = counts.keys() - names.keys()
+        if missing:
+            names.update(db.query(models.Contestant.id, models.Contestant.name).filter(models.Contestant.id.in_(missing)).all())
+        entries = _rank_contestants((counts.get(contestant_id, 0), contestant_id, name) for contestant_id, name in names.items())
+        db.add(models.VotingLineResult(
+            voting_line_id=line.id, total_votes=sum(counts.values()), unique_voters=unique_voters,
+            checksum=_results_checksum(line.id, counts, unique_voters), finalized_at=now,
+            entries=[models.VotingLineResultEntry(**entry) for entry in entries]
+        ))
     db.commit()
+    return [line.id for line in lines]
+
+def get_voting_line_result(db: Session, voting_line_id: int):
+    """The frozen results of a line, or None if it has not been finalized."""
+    result = results_cache.get(voting_line_id)
+    if result is None:
+        row = db.query(models.VotingLineResult).filter(models.VotingLineResult.voting_line_id == voting_line_id).first()
+        if row is None:
+            return None
+        line = get_cached_voting_line(db, voting_line_id)
+        result = {
+            "voting_line_id": voting_line_id, "voting_line_name": line.name, "total_votes": row.total_votes,
+            "unique_voters": row.unique_voters, "checksum": row.checksum, "finalized_at": row.finalized_at,
+            "entries": [{"rank": e.rank, "contestant_id": e.contestant_id, "contestant_name": e.contestant_name, "total_votes": e.total_votes} for e in row.entries],
+        }
+        results_cache.set(voting_line_id, result)
+    return result
+
+def verify_voting_line_result(db: Session, voting_line_id: int) -> bool:
+    """Recomputes the checksum from the raw votes and compares it with the snapshot's."""
+    result = get_voting_line_result(db, voting_line_id)
+    counts, unique_voters = _aggregate_line_votes(db, voting_line_id)
+    return result is not None and result["checksum"] == _results_checksum(voting_line_id, counts, unique_voters)
+
+# --- Idempotency Functions (HIGHLIGHT: New section) ---
+# Keys live in the idempotency_keys table so every worker sees them; each worker also keeps
+# a small cache of recent keys so most replays don't reach the database at all.
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", str(24 * 60 * 60)))
+idempotency_cache = TTLCache(maxsize=10000, ttl=min(IDEMPOTENCY_KEY_TTL_SECONDS, 300))
+_last_idempotency_purge = 0.0
+
+def get_idempotent_response(db: Session, user_id: int, key: str):
+    """Returns (status code, response) stored for a user's idempotency key, or None if it is unknown or expired."""
+    stored = idempotency_cache.get((user_id, key))
+    if stored is not None:
+        return stored
+    row = db.query(models.IdempotencyKey.status_code, models.IdempotencyKey.response_body).filter(
+        models.IdempotencyKey.user_id == user_id,
+        models.IdempotencyKey.key == key,
+        models.IdempotencyKey.expires_at > datetime.now(timezone.utc)
+    ).first()
+    if row is None:
+        return None
+    stored = (row.status_code, json.loads(row.response_body))
+    idempotency_cache.set((user_id, key), stored)
+    return stored
+
+def save_idempotent_response(db: Session, user_id: int, key: str, response: dict, status_code: int = 200) -> bool:
+    """
+    Stores the key in the current transaction; the caller commits it together with its writes.
+    An expired row for the key that the purge hasn't removed yet is replaced. Returns False
+    if the key is held by a live response (the caller's request is a replay).
+    """
+    _purge_expired_idempotency_keys(db)
+    now = datetime.now(timezone.utc)
+    stmt = _upsert(db, models.IdempotencyKey).values(
+        user_id=user_id,
+        key=key,
+        status_code=status_code,
+        response_body=json.dumps(response),
+        created_at=now,
+        expires_at=now + timedelta(seconds=IDEMPOTENCY_KEY_TTL_SECONDS)
+    )
+    result = db.execute(stmt.on_conflict_do_update(
+        index_elements=["user_id", "key"],
+        set_={name: stmt.excluded[name] for name in ("status_code", "response_body", "created_at", "expires_at")},
+        where=models.IdempotencyKey.expires_at <= now
+    ))
+    return result.rowcount > 0
+
+def _purge_expired_idempotency_keys(db: Session):
+    # Keeps the table bounded; runs at most once a minute per worker.
+    global _last_idempotency_purge
+    now = datetime.now(timezone.utc)
+    if now.timestamp() - _last_idempotency_purge < 60:
+        return
+    _last_idempotency_purge = now.timestamp()
+    db.execute(delete(models.IdempotencyKey).where(models.IdempotencyKey.expires_at <= now))
 
 # --- Dashboard Functions (HIGHLIGHT: New section) ---
 def get_dashboard_stats(db: Session, voting_line_id: int):
     """Calculates the vote count for each contestant for a given voting line."""
+    line = get_cached_voting_line(db, voting_line_id)
+    if line is None:
+        return []
+    # Ended lines are served from their frozen results instead of aggregating the votes again;
+    # lines without results are counted exactly from the votes (the handler reads the replica)
+    result = get_voting_line_result(db, voting_line_id) if _as_utc(line.end_time) < datetime.now(timezone.utc) else None
+    if result is not None:
+        return [
+            {"contestant_id": e["contestant_id"], "contestant_name": e["contestant_name"], "total_votes": e["total_votes"]}
+            for e in result["entries"] if e["total_votes"]
+        ]
     results = db.query(
         models.Contestant.id,
         models.Contestant.name,
@@ -157,7 +893,6 @@ def get_dashboard_stats(db: Session, voting_line_id: int):
     ).order_by(
         desc('total_votes')
     ).all()
-    
     return [
         {"contestant_id": r[0], "contestant_name": r[1], "total_votes": r[2] or 0}
         for r in results
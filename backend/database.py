@@ -1,9 +1,14 @@
 # ~/idol_voting/backend/database.py
 
+import logging
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -21,6 +26,110 @@ engine = create_engine(DATABASE_URL)
 # The session is the primary interface for all database operations.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# --- Read Replica (HIGHLIGHT: New section) ---
+# Optional streaming replica for read-only endpoints. Without REPLICA_DATABASE_URL every
+# read goes to the primary, as before.
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+# Reads fall back to the primary while the replica is further behind than this
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "2"))
+# A replica that stops answering must not hold up requests: connecting gives up after this,
+# and so does the lag probe's query
+REPLICA_TIMEOUT_SECONDS = int(os.getenv("REPLICA_TIMEOUT_SECONDS", "2"))
+
+if REPLICA_DATABASE_URL:
+    replica_engine = create_engine(REPLICA_DATABASE_URL, connect_args={"connect_timeout": REPLICA_TIMEOUT_SECONDS} if REPLICA_DATABASE_URL.startswith("postgresql") else {})
+else:
+    replica_engine = engine
+
+logger = logging.getLogger("idol_voting.database")
+
+# A replica streaming from the primary that has replayed everything it received is not
+# lagging, however old its last transaction is (e.g. when nobody is voting). Without a
+# streaming WAL receiver it has also replayed all it received but may be far behind, so
+# its lag is the age of the last replayed transaction (unknown counts as unusable).
+REPLICA_LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+            AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+    END
+""")
+
+def replica_lag_seconds() -> float:
+    """Replication lag of the replica as reported by the replica itself."""
+    if replica_engine.dialect.name != "postgresql":
+        return 0.0
+    with replica_engine.connect() as connection:
+        connection.execute(text(f"SET LOCAL statement_timeout = {REPLICA_TIMEOUT_SECONDS * 1000}"))
+        return float(connection.execute(REPLICA_LAG_SQL).scalar())
+
+class ReplicaLagMonitor:
+    """
+    Probes the replica's lag every REPLICA_LAG_CHECK_SECONDS in a background thread (one per
+    worker, started by the app's lifespan); requests only read the last result. A result older
+    than a few probe intervals (the probe itself is stuck) counts as unusable.
+    """
+
+    def __init__(self):
+        self.usable = False
+        self.checked_at = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None or replica_engine is engine:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="replica-lag-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=REPLICA_TIMEOUT_SECONDS + 1)
+        self._thread = None
+        self.usable = False
+
+    def check(self):
+        try:
+            lag = replica_lag_seconds()
+            usable = lag <= REPLICA_MAX_LAG_SECONDS
+            if usable != self.usable:
+                logger.warning("Read replica %s (lag %.1fs)", "back in use" if usable else "bypassed", lag)
+        except Exception:
+            logger.exception("Read replica lag check failed; reading from the primary")
+            usable = False
+        self.usable, self.checked_at = usable, time.monotonic()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.check()
+            self._stopped.wait(REPLICA_LAG_CHECK_SECONDS)
+
+replica_monitor = ReplicaLagMonitor()
+
+def replica_usable() -> bool:
+    """Whether reads may go to the replica, as of the monitor's last probe; never blocks."""
+    return replica_monitor.usable and time.monotonic() - replica_monitor.checked_at < 3 * REPLICA_LAG_CHECK_SECONDS
+
+class RoutingSession(Session):
+    """
+    Session for read-only endpoints: SELECTs go to the replica when it is caught up.
+    Flushes, INSERT/UPDATE/DELETE and SELECT ... FOR UPDATE always go to the primary, and
+    once the session has written it stays on the primary so it reads its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or isinstance(clause, UpdateBase) or (isinstance(clause, Select) and clause._for_update_arg is not None):
+            self.info["wrote"] = True
+        if self.info.get("wrote") or not replica_usable():
+            return engine
+        return replica_engine
+
+ReadSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
+
 # We will inherit from this class to create each of the ORM models.
 Base = declarative_base()
 
@@ -31,3 +140,12 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependency for read-only endpoints that can tolerate REPLICA_MAX_LAG_SECONDS of staleness.
+# Quota checks and anything else that must see the latest writes use get_db.
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,224 @@
+# ~/idol_voting/backend/generate_data.py
+"""
+Synthetic data generator for capacity testing.
+
+Creates contestants and (closed) voting lines through the models, then bulk-loads users,
+OTPs and votes with COPY on Postgres (DBAPI executemany elsewhere, e.g. SQLite) and
+rebuilds the voting_line_tallies / hourly rollups for the generated lines.
+The distributions are skewed like a real show:
+- contestant popularity follows a Zipf curve (a few favourites take most votes)
+- votes per user per line are Pareto distributed (most vote a little, a heavy tail votes up
+  to max_votes_per_user), split into submits of a few votes each
+- votes cluster towards the end of each line's window
+
+Run it against a migrated database (`alembic upgrade head` first), never production.
+
+Usage: python generate_data.py --votes 50000000 [--users N] [--lines 1] [--contestants 12] [--seed 42]
+"""
+import argparse
+import io
+import random
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice
+
+from sqlalchemy import delete, select, text
+
+from database import SessionLocal, engine
+import models
+
+# Pareto shape for votes per user per line; ~1.2 gives an 80/20-like heavy tail
+VOTER_TAIL_ALPHA = 1.2
+# Zipf exponent for contestant popularity
+POPULARITY_EXPONENT = 1.1
+# Votes per submit, drawn uniformly from this list
+SUBMIT_SIZES = [1, 1, 1, 2, 2, 3, 5, 10]
+# Average vote rows per user per line with the distributions above (about 1.8), rounded down
+ESTIMATED_ROWS_PER_VOTER = 1.5
+
+
+class BulkLoader:
+    """Loads rows through COPY on Postgres and DBAPI executemany on anything else."""
+
+    def __init__(self, engine, batch_size: int, check_foreign_keys: bool = False):
+        self.connection = engine.raw_connection()
+        self.postgres = engine.dialect.name == "postgresql"
+        self.placeholder = "?" if engine.dialect.paramstyle == "qmark" else "%s"
+        self.batch_size = batch_size
+        self._times = {}
+        if engine.dialect.name == "sqlite":
+            cursor = self.connection.cursor()
+            cursor.execute("PRAGMA synchronous = OFF")
+            cursor.close()
+        if self.postgres and not check_foreign_keys:
+            # Foreign keys are enforced by per-row triggers, which dominate COPY time. Every ID
+            # loaded here was just read back from the DB, so skip them for this session (superuser only).
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute("SET session_replication_role = replica")
+                self.connection.commit()
+            except Exception as exc:
+                self.connection.rollback()
+                print(f"Loading with foreign key checks ({exc.__class__.__name__}: not a superuser?)")
+            finally:
+                cursor.close()
+
+    def timestamp(self, epoch_seconds: int) -> str:
+        """Formats a UTC timestamp the way the DB column expects it (cached per second)."""
+        value = self._times.get(epoch_seconds)
+        if value is None:
+            moment = datetime.fromtimestamp(epoch_seconds, timezone.utc)
+            # SQLite stores DateTime as SQLAlchemy's naive string format
+            value = moment.strftime("%Y-%m-%d %H:%M:%S+00") if self.postgres else moment.strftime("%Y-%m-%d %H:%M:%S.000000")
+            self._times[epoch_seconds] = value
+        return value
+
+    def load(self, table: str, columns: tuple, rows) -> int:
+        cursor = self.connection.cursor()
+        loaded = 0
+        try:
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                if self.postgres:
+                    # Values are ints, booleans, digits-only codes and plain identifiers: no quoting needed
+                    buffer = io.StringIO("".join(",".join("" if value is None else str(value) for value in row) + "\n" for row in batch))
+                    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+                else:
+                    cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join([self.placeholder] * len(columns))})", batch)
+                loaded += len(batch)
+            self.connection.commit()
+        finally:
+            cursor.close()
+        return loaded
+
+    def close(self):
+        self.connection.close()
+
+
+def identifier(index: int) -> tuple:
+    """(mobile_number, email) of the index-th generated user; one in five signs up by email."""
+    if index % 5 == 4:
+        return None, f"synthetic{index}@example.com"
+    return f"+99{index:010d}", None
+
+
+def create_lines(db, contestant_count: int, line_count: int, hours: int, max_votes: int, now: datetime) -> list:
+    contestants = [models.Contestant(name=f"Synthetic Contestant {n + 1}", age=18 + n % 12, gender=("Male", "Female", "Others")[n % 3]) for n in range(contestant_count)]
+    lines = []
+    for n in range(line_count):
+        end = now - timedelta(hours=hours * (line_count - n - 1))
+        lines.append(models.VotingLine(name=f"Synthetic Line {n + 1}", start_time=end - timedelta(hours=hours), end_time=end, max_votes_per_user=max_votes, is_active=False, contestants=contestants))
+    db.add_all(contestants + lines)
+    db.commit()
+    return [(line.id, int(line.start_time.timestamp()), int(line.end_time.timestamp()), [c.id for c in contestants]) for line in lines]
+
+
+def user_rows(loader: BulkLoader, first_index: int, count: int, oldest: int, newest: int):
+    for index in range(first_index, first_index + count):
+        mobile_number, email = identifier(index)
+        yield mobile_number, email, loader.timestamp(random.randint(oldest, newest))
+
+
+def otp_rows(loader: BulkLoader, first_index: int, user_count: int, count: int, oldest: int, newest: int):
+    for _ in range(count):
+        mobile_number, email = identifier(first_index + random.randrange(user_count))
+        sent = random.randint(oldest, newest)
+        yield mobile_number, email, f"{random.randrange(1000000):06d}", loader.timestamp(sent + 300), random.random() < 0.9, loader.timestamp(sent)
+
+
+def vote_rows(loader: BulkLoader, user_ids: array, lines: list, target: int, max_votes: int, stats: dict):
+    produced = 0
+    for line_id, start, end, contestant_ids in lines:
+        favourites = random.sample(contestant_ids, len(contestant_ids))
+        cum_weights = list(accumulate(1 / (rank ** POPULARITY_EXPONENT) for rank in range(1, len(favourites) + 1)))
+        for user_id in user_ids:
+            if produced >= target:
+                return
+            total = min(max_votes, int(random.paretovariate(VOTER_TAIL_ALPHA)))
+            # A voting session: consecutive submits a few seconds apart, late in the window more often
+            moment = int(random.triangular(start, end, end))
+            while total > 0 and produced < target:
+                count = min(total, random.choice(SUBMIT_SIZES))
+                contestant_id = random.choices(favourites, cum_weights=cum_weights)[0]
+                yield user_id, contestant_id, line_id, count, loader.timestamp(min(moment, end))
+                total -= count
+                moment += random.randint(2, 20)
+                produced += 1
+                stats["votes"] += count
+    stats["short"] = target - produced
+
+
+def rebuild_aggregates(line_ids: list):
+    """Recomputes tallies and hourly rollups of the generated lines from the votes table."""
+    hour = "date_trunc('hour', created_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'" if engine.dialect.name == "postgresql" else "strftime('%Y-%m-%d %H:00:00.000000', created_at)"
+    with engine.begin() as connection:
+        for table in (models.VotingLineTally, models.VoteRollupMinute, models.VoteRollupHour):
+            connection.execute(delete(table).where(table.voting_line_id.in_(line_ids)))
+        for line_id in line_ids:
+            connection.execute(text(
+                "INSERT INTO voting_line_tallies (voting_line_id, contestant_id, total_votes) "
+                "SELECT voting_line_id, contestant_id, SUM(vote_count) FROM votes WHERE voting_line_id = :line_id GROUP BY 1, 2"
+            ), {"line_id": line_id})
+            connection.execute(text(
+                "INSERT INTO vote_rollups_hourly (voting_line_id, contestant_id, bucket_start, votes) "
+                f"SELECT voting_line_id, contestant_id, {hour}, SUM(vote_count) FROM votes WHERE voting_line_id = :line_id GROUP BY 1, 2, 3"
+            ), {"line_id": line_id})
+
+
+def timed(label: str, load):
+    start = time.perf_counter()
+    rows = load()
+    seconds = time.perf_counter() - start
+    print(f"{label}: {rows:,} rows in {seconds:.1f}s ({rows / max(seconds, 1e-9):,.0f} rows/s)")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-load synthetic users, OTPs and votes for capacity testing.")
+    parser.add_argument("--votes", type=int, default=1_000_000, help="vote rows to generate (default: 1,000,000)")
+    parser.add_argument("--users", type=int, help=f"users to generate (default: votes / {ESTIMATED_ROWS_PER_VOTER} / lines)")
+    parser.add_argument("--otps", type=int, help="OTP rows to generate (default: one per user)")
+    parser.add_argument("--lines", type=int, default=1, help="voting lines to create (default: 1)")
+    parser.add_argument("--contestants", type=int, default=12, help="contestants per line (default: 12)")
+    parser.add_argument("--hours", type=int, default=72, help="length of each voting line (default: 72)")
+    parser.add_argument("--max-votes", type=int, default=50, help="max_votes_per_user of the lines (default: 50)")
+    parser.add_argument("--batch-size", type=int, default=100_000, help="rows per COPY/executemany batch")
+    parser.add_argument("--check-foreign-keys", action="store_true", help="keep foreign key checks on during COPY (slower)")
+    parser.add_argument("--seed", type=int, help="random seed for reproducible data")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    users = args.users or max(1, int(args.votes / ESTIMATED_ROWS_PER_VOTER / args.lines))
+    otps = users if args.otps is None else args.otps
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+
+    db = SessionLocal()
+    loader = BulkLoader(engine, args.batch_size, check_foreign_keys=args.check_foreign_keys)
+    try:
+        lines = create_lines(db, args.contestants, args.lines, args.hours, args.max_votes, now)
+        first_line_start = lines[0][1]
+        print(f"--- Created voting lines {[line[0] for line in lines]} with {args.contestants} contestants ---")
+
+        max_user_id = db.scalar(select(models.User.id).order_by(models.User.id.desc()).limit(1)) or 0
+        # Numbering identifiers after the highest user ID keeps repeated runs from colliding
+        first_index = max_user_id + 1
+        oldest, newest = first_line_start - 30 * 86400, int(now.timestamp())
+        timed("users", lambda: loader.load("users", ("mobile_number", "email", "created_at"), user_rows(loader, first_index, users, oldest, newest)))
+        user_ids = array("q", db.scalars(select(models.User.id).where(models.User.id > max_user_id).order_by(models.User.id).execution_options(yield_per=100_000)))
+        timed("otps", lambda: loader.load("otps", ("mobile_number", "email", "otp_code", "expiry_timestamp", "is_used", "created_at"), otp_rows(loader, first_index, users, otps, oldest, newest)))
+
+        stats = {"votes": 0, "short": 0}
+        timed("votes", lambda: loader.load("votes", ("user_id", "contestant_id", "voting_line_id", "vote_count", "created_at"), vote_rows(loader, user_ids, lines, args.votes, args.max_votes, stats)))
+        print(f"total vote_count: {stats['votes']:,}")
+        if stats["short"]:
+            print(f"Every user hit the end of the lines {stats['short']:,} rows short of --votes; pass more --users or --lines.")
+
+        start = time.perf_counter()
+        rebuild_aggregates([line[0] for line in lines])
+        print(f"tallies and hourly rollups rebuilt in {time.perf_counter() - start:.1f}s")
+    finally:
+        loader.close()
+        db.close()
@@ -0,0 +1,21 @@
+# ~/idol_voting/backend/gunicorn.conf.py
+# Picked up automatically by gunicorn (see Procfile) when started from this directory.
+
+import os
+import shutil
+import tempfile
+
+# Every worker writes its Prometheus samples here so /metrics can aggregate all of them.
+# This has to be set before the workers import prometheus_client.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "idol_voting_metrics"))
+
+def on_starting(server):
+    # Start from an empty directory so samples from a previous run are not reported.
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    # Drop the live gauges (in-flight requests, checked-out connections) of a dead worker.
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,332 @@
+# ~/idol_voting/backend/journal.py
+"""
+Optional local write-ahead journal for vote submissions (enabled by VOTE_JOURNAL_DIR).
+
+Every validated submit is appended to a segment file and fsynced before the database write,
+under an idempotency key. If Postgres is saturated or failing over and the write fails, the
+request is answered 202 and the vote stays in the journal; `replay_journal` later applies it
+through crud.submit_votes with the same key, so it is counted exactly once (the quota is
+enforced at replay time). Votes that did reach the database are skipped by the replayer.
+
+- Appends are group-committed: a flusher thread fsyncs every VOTE_JOURNAL_FSYNC_MS and wakes
+  all requests whose entries that fsync covered.
+- Each worker writes its own segments and holds an flock on the one it is appending to.
+  Segments rotate by size and age; any segment nobody holds a lock on (rotated, or left
+  behind by a crashed worker) is replayed and then deleted.
+- Lines are `<crc32> <json>`; a torn last line from a crash was never acknowledged and is skipped.
+- Entries for a line whose results were already finalized are not applied (the snapshot and
+  its checksum would no longer match the votes); they are recorded as rejected with a 409.
+- Once an entry is journaled the submit is answered 202 if the database write fails for any
+  reason. An entry whose replay fails other than by the database being unavailable is kept
+  in a `.unresolved` segment for manual recovery, so it can't hold up the others.
+
+Recovery tool: `python journal.py verify [dir]` checks every journal entry against the
+database; `python journal.py replay [dir]` applies pending ones.
+"""
+import fcntl
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.exc import OperationalError
+
+import crud
+import models
+
+logger = logging.getLogger("idol_voting.journal")
+
+JOURNAL_DIR = os.getenv("VOTE_JOURNAL_DIR")
+FSYNC_INTERVAL_SECONDS = float(os.getenv("VOTE_JOURNAL_FSYNC_MS", "5")) / 1000
+SEGMENT_MAX_BYTES = int(os.getenv("VOTE_JOURNAL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+# Rotating by age too keeps entries that missed the database from waiting long for a replay
+SEGMENT_MAX_SECONDS = float(os.getenv("VOTE_JOURNAL_SEGMENT_SECONDS", "30"))
+SEGMENT_SUFFIX = ".journal"
+
+ENTRY_APPLIED = "applied"
+ENTRY_REJECTED = "rejected"
+ENTRY_PENDING = "pending"
+ENTRY_EXPIRED = "expired"
+ENTRY_FAILED = "failed"  # replay raised; left for manual recovery
+
+
+def encode_entry(entry: dict) -> bytes:
+    body = json.dumps(entry, separators=(",", ":"), sort_keys=True)
+    return f"{zlib.crc32(body.encode()):08x} {body}\n".encode()
+
+
+def read_segment(path: str):
+    """Returns (entries, corrupt line count, whether the last line was torn)."""
+    with open(path, "rb") as segment:
+        data = segment.read()
+    lines = data.split(b"\n")
+    torn = lines.pop() != b""
+    entries, corrupt = [], 0
+    for line in lines:
+        checksum, _, body = line.partition(b" ")
+        try:
+            if int(checksum, 16) != zlib.crc32(body):
+                raise ValueError("checksum mismatch")
+            entries.append(json.loads(body))
+        except ValueError:
+            corrupt += 1
+    return entries, corrupt, torn
+
+
+def segment_paths(directory: str) -> list:
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+
+class VoteJournal:
+    """Append-only, fsync-batched journal of vote submissions for one worker process."""
+
+    def __init__(self, directory: str, fsync_interval: float = FSYNC_INTERVAL_SECONDS):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Condition()
+        self._fd = None
+        self._segment_bytes = 0
+        self._segment_opened = 0.0
+        self._written = 0
+        self._synced = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopped.clear()
+        with self._lock:
+            self._open_segment()
+        self._thread = threading.Thread(target=self._flush_loop, name="vote-journal-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            self._lock.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+        with self._lock:
+            self._close_segment()
+
+    def append(self, user_id: int, voting_line_id: int, votes: dict, max_votes: int, idempotency_key: str = None) -> str:
+        """Writes a submit to the journal and returns once it is on disk; returns its idempotency key."""
+        key = idempotency_key or f"journal-{uuid.uuid4().hex}"
+        line = encode_entry({
+            "key": key, "user_id": user_id, "voting_line_id": voting_line_id, "max_votes": max_votes,
+            "votes": {str(contestant_id): count for contestant_id, count in votes.items()}, "at": time.time(),
+        })
+        with self._lock:
+            if self._fd is None:
+                raise RuntimeError("Vote journal is not running")
+            if self._segment_bytes and (self._segment_bytes + len(line) > SEGMENT_MAX_BYTES or time.monotonic() - self._segment_opened > SEGMENT_MAX_SECONDS):
+                self._close_segment()
+                self._open_segment()
+            os.write(self._fd, line)
+            self._segment_bytes += len(line)
+            self._written += 1
+            position = self._written
+            self._lock.notify_all()
+            while self._synced < position:
+                if self._fd is None:
+                    raise RuntimeError("Vote journal stopped before the entry was synced")
+                self._lock.wait()
+        return key
+
+    def _open_segment(self):
+        path = os.path.join(self.directory, f"{time.time_ns():020d}-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        # Created and locked under a name segment_paths skips, so the replayer never sees it unlocked
+        fd = os.open(path + ".opening", os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o644)
+        # Held while this worker appends to the segment; the replayer leaves locked segments alone
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.rename(path + ".opening", path + SEGMENT_SUFFIX)
+        self._fd = fd
+        self._segment_bytes = 0
+        self._segment_opened = time.monotonic()
+
+    def _close_segment(self):
+        if self._fd is None:
+            return
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = None
+        self._synced = self._written
+        self._lock.notify_all()
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            with self._lock:
+                while self._synced == self._written and not self._stopped.is_set():
+                    self._lock.wait()
+            # Let concurrent requests join this fsync
+            time.sleep(self.fsync_interval)
+            with self._lock:
+                if self._fd is None:
+                    continue
+                # fsync a duplicate outside the lock so appends carry on meanwhile; a rotation
+                # closing self._fd doesn't close the file under us
+                target, fd = self._written, os.dup(self._fd)
+            try:
+                os.fsync(fd)
+            except OSError:
+                logger.exception("Vote journal fsync failed")
+                continue
+            finally:
+                os.close(fd)
+            with self._lock:
+                self._synced = max(self._synced, target)
+                self._lock.notify_all()
+
+
+def _entry_states(db, entries: list) -> dict:
+    """(user_id, key) -> status code stored for the key, for keys that reached the database."""
+    states = {}
+    pairs = list({(entry["user_id"], entry["key"]) for entry in entries})
+    for start in range(0, len(pairs), 1000):
+        batch = pairs[start:start + 1000]
+        rows = db.query(models.IdempotencyKey.user_id, models.IdempotencyKey.key, models.IdempotencyKey.status_code).filter(
+            tuple_(models.IdempotencyKey.user_id, models.IdempotencyKey.key).in_(batch)
+        ).all()
+        states.update({(row.user_id, row.key): row.status_code for row in rows})
+    return states
+
+
+def classify(entry: dict, states: dict, now: float) -> str:
+    status_code = states.get((entry["user_id"], entry["key"]))
+    if status_code is not None:
+        return ENTRY_APPLIED if status_code == 200 else ENTRY_REJECTED
+    # Past the key TTL the key may have been purged after all, so replaying could double count
+    if now - entry["at"] > crud.IDEMPOTENCY_KEY_TTL_SECONDS:
+        return ENTRY_EXPIRED
+    return ENTRY_PENDING
+
+
+def _reject_entry(db, entry: dict, status_code: int, detail: str) -> str:
+    # Recorded under the key so the entry is resolved and a client retry gets the same answer
+    crud.save_idempotent_response(db, user_id=entry["user_id"], key=entry["key"], response={"detail": detail}, status_code=status_code)
+    db.commit()
+    return ENTRY_REJECTED
+
+
+def replay_entry(db, entry: dict) -> str:
+    # The share lock on the line is held until submit_votes commits; finalize_closed_voting_lines
+    # locks the line for update, so a replay lands either before the snapshot or sees it here
+    db.query(models.VotingLine.id).filter(models.VotingLine.id == entry["voting_line_id"]).with_for_update(read=True).first()
+    if db.query(models.VotingLineResult.voting_line_id).filter(models.VotingLineResult.voting_line_id == entry["voting_line_id"]).first() is not None:
+        logger.error("Journaled submit %s for voting line %d arrived after its results were finalized; not counted", entry["key"], entry["voting_line_id"])
+        return _reject_entry(db, entry, 409, "Voting closed before these votes could be counted.")
+    response = {"status": "success", "message": "Votes submitted successfully."}
+    votes = {int(contestant_id): count for contestant_id, count in entry["votes"].items()}
+    outcome = crud.submit_votes(db, user_id=entry["user_id"], voting_line_id=entry["voting_line_id"], votes=votes, max_votes=entry["max_votes"], idempotency_key=entry["key"], response=response)
+    if outcome == crud.VOTES_REJECTED:
+        return _reject_entry(db, entry, 400, "Vote limit exceeded.")
+    return ENTRY_APPLIED
+
+
+def replay_journal(db, directory: str = JOURNAL_DIR) -> dict:
+    """Applies pending entries of every unlocked segment, deleting segments once fully resolved."""
+    counts = defaultdict(int)
+    for path in segment_paths(directory or ""):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # a worker is still appending to it, or another replayer has it
+            if not os.path.exists(path):
+                continue  # replayed and deleted while we waited for the lock
+            entries, corrupt, _ = read_segment(path)
+            states = _entry_states(db, entries)
+            now = time.time()
+            unresolved = corrupt
+            for entry in entries:
+                state = classify(entry, states, now)
+                if state == ENTRY_PENDING:
+                    try:
+                        state = replay_entry(db, entry)
+                    except OperationalError:
+                        raise  # database unavailable: the segment stays put for the next run
+                    except Exception:
+                        db.rollback()
+                        logger.exception("Could not replay journaled submit %s", entry["key"])
+                        state = ENTRY_FAILED
+                    counts["replayed"] += 1
+                if state in (ENTRY_EXPIRED, ENTRY_FAILED):
+                    unresolved += 1
+                counts[state] += 1
+            if unresolved:
+                logger.error("Vote journal segment %s has %d entries that need manual recovery (python journal.py verify)", path, unresolved)
+                os.rename(path, path + ".unresolved")
+            else:
+                os.remove(path)
+        finally:
+            os.close(fd)
+    if counts["replayed"]:
+        logger.warning("Replayed %d journaled vote submits", counts["replayed"])
+    return dict(counts)
+
+
+def verify_journal(db, directory: str) -> dict:
+    """Checks every journal entry (including unresolved segments) against the database."""
+    report = defaultdict(int)
+    journaled = defaultdict(int)
+    paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if SEGMENT_SUFFIX in name]
+    for path in paths:
+        entries, corrupt, torn = read_segment(path)
+        report["segments"] += 1
+        report["corrupt"] += corrupt
+        report["torn"] += int(torn)
+        states = _entry_states(db, entries)
+        now = time.time()
+        for entry in entries:
+            state = classify(entry, states, now)
+            report[state] += 1
+            if state == ENTRY_APPLIED:
+                journaled[(entry["user_id"], entry["voting_line_id"])] += sum(entry["votes"].values())
+    # Applied entries must be backed by at least as many stored votes for that user and line
+    pairs = list(journaled)
+    for start in range(0, len(pairs), 1000):
+        batch = pairs[start:start + 1000]
+        stored = dict(((row.user_id, row.voting_line_id), row.votes) for row in db.query(
+            models.Vote.user_id, models.Vote.voting_line_id, func.sum(models.Vote.vote_count).label("votes")
+        ).filter(tuple_(models.Vote.user_id, models.Vote.voting_line_id).in_(batch)).group_by(models.Vote.user_id, models.Vote.voting_line_id).all())
+        report["missing_votes"] += sum(1 for pair in batch if stored.get(pair, 0) < journaled[pair])
+    return dict(report)
+
+
+# One journal per worker process when VOTE_JOURNAL_DIR is set; started and stopped by main.py
+vote_journal = VoteJournal(JOURNAL_DIR) if JOURNAL_DIR else None
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "verify"
+    directory = sys.argv[2] if len(sys.argv) > 2 else JOURNAL_DIR
+    if command not in ("verify", "replay") or not directory:
+        sys.exit("Usage: python journal.py verify|replay [journal dir]  (defaults to VOTE_JOURNAL_DIR)")
+    db = SessionLocal()
+    try:
+        if command == "replay":
+            print(f"--- Replay: {replay_journal(db, directory)} ---")
+        report = verify_journal(db, directory)
+    finally:
+        db.close()
+    print(f"--- Journal {directory} ---")
+    for name in ("segments", ENTRY_APPLIED, ENTRY_REJECTED, ENTRY_PENDING, ENTRY_EXPIRED, "corrupt", "torn", "missing_votes"):
+        print(f"{name}: {report.get(name, 0)}")
+    ok = not any(report.get(name) for name in (ENTRY_PENDING, ENTRY_EXPIRED, "corrupt", "missing_votes"))
+    print("OK" if ok else "INCONSISTENT: run `python journal.py replay`, then inspect what remains")
+    sys.exit(0 if ok else 1)
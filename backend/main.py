@@ -1,25 +1,84 @@
 # ~/idol_voting/backend/main.py
 
 import os
-from typing import List
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Header, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from jose import JWTError, jwt
+from jose import JWTError
 from fastapi.security import OAuth2PasswordBearer
 
-import models, schemas, crud, security
-from database import engine, get_db
+import models, schemas, crud, security, metrics, profiling, pubsub, contestant_import, admission, otp_delivery, anomaly
+from scheduler import scheduler, aggregate_flusher, aggregate_reconciler, rollup_compactor, results_finalizer, journal_replayer
+from journal import vote_journal
+from anomaly import detector
+from otp_delivery import delivery_queue
+from database import engine, replica_engine, replica_monitor, get_db, get_read_db
 
-models.Base.metadata.create_all(bind=engine)
+# Schema changes are applied with alembic (`alembic upgrade head`) before deploying,
+# so importing the app (once per gunicorn worker) does not touch the database.
+
+# Evicts this worker's caches when another worker publishes a change (Postgres only)
+cache_listener = pubsub.CacheInvalidationListener(engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background work that runs in every worker
+    replica_monitor.start()
+    cache_listener.start()
+    scheduler.start()
+    aggregate_flusher.start()
+    aggregate_reconciler.start()
+    rollup_compactor.start()
+    results_finalizer.start()
+    if vote_journal is not None:
+        vote_journal.start()
+        journal_replayer.start()
+    detector.start()
+    delivery_queue.start()
+    yield
+    delivery_queue.stop()
+    detector.stop()
+    if vote_journal is not None:
+        journal_replayer.stop()
+        vote_journal.stop()
+    results_finalizer.stop()
+    rollup_compactor.stop()
+    aggregate_reconciler.stop()
+    # Write whatever this worker accepted since the last flush
+    aggregate_flusher.stop()
+    aggregate_flusher.run_once()
+    scheduler.stop()
+    cache_listener.stop()
+    replica_monitor.stop()
 
 app = FastAPI(
     title="Indian Idol Voting API",
     description="API for managing votes, contestants, and users.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# --- Admission Control (HIGHLIGHT: New section) ---
+# Registered before the metrics middleware so shed requests still show up in the latency metrics
+app.middleware("http")(admission.controller)
+
+# --- Metrics (HIGHLIGHT: New section) ---
+metrics.instrument_engine(engine)
+if replica_engine is not engine: metrics.instrument_engine(replica_engine)
+metrics.instrument_crud(crud)
+app.middleware("http")(metrics.track_requests)
+
+# --- SQL Profiling & Slow Request Log (HIGHLIGHT: New section) ---
+profiling.instrument_engine(engine)
+if replica_engine is not engine: profiling.instrument_engine(replica_engine)
+app.middleware("http")(profiling.profile_requests)
+
 # --- CORS Middleware ---
+# Added last so it is the outermost middleware: shed 503s get CORS headers too
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 ADMIN_FRONTEND_URL = os.getenv("ADMIN_FRONTEND_URL", "http://localhost:3000")
 app.add_middleware(
@@ -37,7 +96,7 @@ oauth2_scheme_user = OAuth2PasswordBearer(tokenUrl="/api/auth/verify-otp")
 async def get_current_admin(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"},)
     try:
-        payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
+        payload = security.decode_access_token(token)
         username: str = payload.get("sub")
         if username is None or payload.get("type") != "admin": raise credentials_exception
     except JWTError: raise credentials_exception
@@ -48,7 +107,7 @@ async def get_current_admin(token: str = Depends(oauth2_scheme), db: Session = D
 async def get_current_user(token: str = Depends(oauth2_scheme_user), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"},)
     try:
-        payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
+        payload = security.decode_access_token(token)
         # HIGHLIGHT: The JWT subject is now the user ID
         user_id: int = payload.get("sub")
         if user_id is None or payload.get("type") != "user": raise credentials_exception
@@ -60,31 +119,45 @@ async def get_current_user(token: str = Depends(oauth2_scheme_user), db: Session
 # --- User Auth Endpoints (HIGHLIGHT: Updated) ---
 @app.post("/api/auth/send-otp", response_model=schemas.StatusResponse)
 def send_otp(request: schemas.IdentifierRequest, db: Session = Depends(get_db)):
-    """Generates and sends an OTP to the user's mobile or email."""
-    crud.create_otp(db, mobile=request.mobile_number, email=request.email)
+    """Generates an OTP and queues it for delivery to the user's mobile or email."""
+    otp = crud.create_otp(db, mobile=request.mobile_number, email=request.email)
+    if not delivery_queue.enqueue(otp_delivery.message_for(otp)):
+        raise HTTPException(status_code=503, detail="Could not send the OTP. Please try again shortly.")
     return {"status": "success", "message": "OTP sent successfully."}
 
 @app.post("/api/auth/verify-otp", response_model=schemas.Token)
 def verify_otp_and_login(request: schemas.OTPVerifyRequest, db: Session = Depends(get_db)):
-    """Verifies OTP and returns a token."""
-    verified_otp = crud.verify_otp(db, otp_code=request.otp_code, mobile=request.mobile_number, email=request.email)
-    if not verified_otp:
+    """Verifies OTP and returns a token, creating the user on first login."""
+    login = crud.login_with_otp(db, otp_code=request.otp_code, mobile=request.mobile_number, email=request.email)
+    if not login:
         raise HTTPException(status_code=400, detail="Invalid or expired OTP.")
-    
-    user = crud.get_user_by_identifier(db, mobile=request.mobile_number, email=request.email)
-    if not user:
-        user_data = schemas.UserCreate(mobile_number=request.mobile_number, email=request.email)
-        user = crud.create_user(db, user=user_data)
-    
+    user_id, refresh_token = login
+
     # Use the unique user ID as the subject of the token
-    access_token = security.create_access_token(data={"sub": str(user.id), "type": "user"})
-    return {"access_token": access_token, "token_type": "bearer"}
+    access_token = security.create_access_token(data={"sub": str(user_id), "type": "user"})
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@app.post("/api/auth/refresh", response_model=schemas.Token)
+def refresh_access_token(request: schemas.RefreshTokenRequest, db: Session = Depends(get_db)):
+    """Exchanges a refresh token for a new access token and the next refresh token."""
+    rotated = crud.rotate_refresh_token(db, token=request.refresh_token)
+    if not rotated:
+        raise HTTPException(status_code=401, detail="Invalid or expired refresh token.")
+    user_id, refresh_token = rotated
+    access_token = security.create_access_token(data={"sub": str(user_id), "type": "user"})
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@app.post("/api/auth/logout", response_model=schemas.StatusResponse)
+def logout(request: schemas.RefreshTokenRequest, db: Session = Depends(get_db)):
+    """Revokes the refresh token's family so it can no longer be used."""
+    crud.revoke_refresh_token(db, token=request.refresh_token)
+    return {"status": "success", "message": "Logged out."}
 
 # --- Admin, Contestant, Voting Line, Voting, Dashboard, and History endpoints remain the same ---
 @app.post("/api/admin/login", response_model=schemas.Token)
 def admin_login(form_data: schemas.AdminLoginRequest, db: Session = Depends(get_db)):
-    admin = crud.get_admin_by_username(db, username=form_data.username)
-    if not admin or not security.verify_password(form_data.password, admin.hashed_password):
+    admin = crud.authenticate_admin(db, username=form_data.username, password=form_data.password)
+    if not admin:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect username or password")
     access_token = security.create_access_token(data={"sub": admin.username, "type": "admin"})
     return {"access_token": access_token, "token_type": "bearer"}
@@ -93,40 +166,95 @@ def create_new_contestant(name: str = Form(...), age: int = Form(...), gender: s
     image_url = f"images/{image.filename}" if image else None
     contestant_data = schemas.ContestantCreate(name=name, age=age, gender=gender, details=details, image_url=image_url)
     return crud.create_contestant(db=db, contestant=contestant_data)
+@app.post("/api/admin/contestants/import", response_model=schemas.ContestantImportResult, status_code=status.HTTP_201_CREATED)
+def import_contestants(csv_file: UploadFile = File(...), images: UploadFile = File(None), db: Session = Depends(get_db), current_admin: models.Admin = Depends(get_current_admin)):
+    """Creates contestants from a CSV (name, age, gender, details, image) and an optional zip of their images."""
+    data = csv_file.file.read(contestant_import.MAX_CSV_BYTES + 1)
+    if len(data) > contestant_import.MAX_CSV_BYTES: raise HTTPException(status_code=413, detail="CSV file is too large.")
+    contestants, image_names, errors = contestant_import.parse_contestant_csv(data)
+    if errors: raise HTTPException(status_code=422, detail=errors)
+    if not contestants: raise HTTPException(status_code=400, detail="CSV has no contestant rows.")
+    stored = {}
+    if images is not None:
+        stored, problems = contestant_import.extract_images(images.file, {name for name in image_names if name})
+        if problems: raise HTTPException(status_code=400, detail=f"Invalid images zip: {'; '.join(problems)}")
+        # Point each row at the unique name its image was stored under
+        contestants = [contestant.model_copy(update={"image_url": f"images/{stored[name]}"}) if name else contestant for contestant, name in zip(contestants, image_names)]
+    try:
+        contestant_ids = crud.create_contestants(db, contestants)
+    except Exception:
+        contestant_import.remove_images(stored.values())
+        raise
+    return {"created": len(contestant_ids), "contestant_ids": contestant_ids}
 @app.get("/api/contestants", response_model=List[schemas.Contestant])
-def get_all_contestants(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_all_contestants(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     return crud.get_contestants(db, skip=skip, limit=limit)
 @app.post("/api/admin/voting-lines", response_model=schemas.VotingLine, status_code=status.HTTP_201_CREATED)
 def create_new_voting_line(voting_line: schemas.VotingLineCreate, db: Session = Depends(get_db), current_admin: models.Admin = Depends(get_current_admin)):
-    return crud.create_voting_line(db=db, voting_line=voting_line)
+    db_voting_line = crud.create_voting_line(db=db, voting_line=voting_line)
+    scheduler.wake()
+    return db_voting_line
 @app.get("/api/admin/voting-lines", response_model=List[schemas.VotingLine])
-def get_all_voting_lines(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_admin: models.Admin = Depends(get_current_admin)):
+def get_all_voting_lines(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db), current_admin: models.Admin = Depends(get_current_admin)):
     return crud.get_voting_lines(db, skip=skip, limit=limit)
 @app.patch("/api/admin/voting-lines/{line_id}/activate", response_model=schemas.VotingLine)
 def activate_voting_line(line_id: int, db: Session = Depends(get_db), current_admin: models.Admin = Depends(get_current_admin)):
-    return crud.update_voting_line_status(db=db, line_id=line_id, is_active=True)
+    db_voting_line = crud.update_voting_line_status(db=db, line_id=line_id, is_active=True)
+    scheduler.wake()
+    return db_voting_line
 @app.patch("/api/admin/voting-lines/{line_id}/deactivate", response_model=schemas.VotingLine)
 def deactivate_voting_line(line_id: int, db: Session = Depends(get_db), current_admin: models.Admin = Depends(get_current_admin)):
-    return crud.update_voting_line_status(db=db, line_id=line_id, is_active=False)
+    db_voting_line = crud.update_voting_line_status(db=db, line_id=line_id, is_active=False)
+    scheduler.wake()
+    return db_voting_line
+@app.get("/api/vote/lines", response_model=List[schemas.VotingLine])
+def get_open_voting_lines(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    """Lists every voting line that is currently open."""
+    return crud.get_active_voting_lines(db, open_lines=scheduler.open_lines())
 @app.get("/api/vote/state", response_model=schemas.PublicVotingPage)
-def get_voting_page_state(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    active_line = crud.get_active_voting_line(db)
+def get_voting_page_state(line_id: Optional[int] = None, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    active_line = crud.get_active_voting_line(db, line_id=line_id, open_lines=scheduler.open_lines())
     if not active_line: raise HTTPException(status_code=404, detail="Voting is currently closed.")
-    contestants = active_line.contestants
     user_votes_cast = crud.get_user_votes_for_line(db, user_id=current_user.id, voting_line_id=active_line.id)
-    return {"voting_line": active_line, "contestants": contestants, "user_total_votes": user_votes_cast}
+    # HIGHLIGHT: Only the user's vote count is serialized per request; the rest is prebuilt per line
+    return Response(content=crud.get_voting_page_prefix(active_line) + b"%d}" % int(user_votes_cast), media_type="application/json")
 @app.post("/api/vote/submit", response_model=schemas.StatusResponse)
-def submit_user_votes(request: schemas.VoteSubmitRequest, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    active_line = crud.get_active_voting_line(db)
+def submit_user_votes(request: schemas.VoteSubmitRequest, idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255), db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    # HIGHLIGHT: Retried requests with the same Idempotency-Key get the original response back
+    if idempotency_key:
+        replay = crud.get_idempotent_response(db, user_id=current_user.id, key=idempotency_key)
+        if replay is not None: return JSONResponse(status_code=replay[0], content=replay[1])
+    active_line = crud.get_active_voting_line(db, line_id=request.voting_line_id, open_lines=scheduler.open_lines())
     if not active_line: raise HTTPException(status_code=403, detail="Voting is currently closed.")
     total_new_votes = sum(request.votes.values())
     if total_new_votes <= 0: raise HTTPException(status_code=400, detail="No votes to submit.")
-    user_votes_cast = crud.get_user_votes_for_line(db, user_id=current_user.id, voting_line_id=active_line.id)
-    if (user_votes_cast + total_new_votes) > active_line.max_votes_per_user: raise HTTPException(status_code=400, detail="Vote limit exceeded.")
-    crud.submit_votes(db, user_id=current_user.id, voting_line_id=active_line.id, votes=request.votes)
-    return {"status": "success", "message": "Votes submitted successfully."}
+    # HIGHLIGHT: Reject contestants that are not on the active line before any writes
+    if not request.votes.keys() <= crud.get_line_contestant_ids(db, voting_line_id=active_line.id):
+        raise HTTPException(status_code=400, detail="Invalid contestant for this voting line.")
+    # HIGHLIGHT: Quota check and insert happen atomically inside crud.submit_votes
+    response = {"status": "success", "message": "Votes submitted successfully."}
+    # Read before the commit expires current_user, so nothing below reloads it
+    voter = anomaly.voter_of(current_user)
+    if vote_journal is not None:
+        # HIGHLIGHT: On disk before the DB write; if the write fails the journal replayer applies it later
+        idempotency_key = vote_journal.append(user_id=current_user.id, voting_line_id=active_line.id, votes=request.votes, max_votes=active_line.max_votes_per_user, idempotency_key=idempotency_key)
+    try:
+        outcome = crud.submit_votes(db, user_id=current_user.id, voting_line_id=active_line.id, votes=request.votes, max_votes=active_line.max_votes_per_user, idempotency_key=idempotency_key, response=response)
+    except Exception:
+        # Once journaled the votes will be counted by the replayer under the same key, whatever
+        # failed here; answering with an error would invite a retry under a new key
+        if vote_journal is None: raise
+        db.rollback()
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"status": "queued", "message": "Votes received and will be counted shortly."})
+    if outcome == crud.VOTES_REJECTED: raise HTTPException(status_code=400, detail="Vote limit exceeded.")
+    if outcome == crud.VOTES_REPLAYED:
+        status_code, replay = crud.get_idempotent_response(db, user_id=voter.id, key=idempotency_key)
+        return JSONResponse(status_code=status_code, content=replay)
+    metrics.record_votes(total_new_votes)
+    detector.observe(voter, voting_line_id=active_line.id, votes=request.votes)
+    return response
 @app.get("/api/vote/history", response_model=schemas.VoteHistoryResponse)
-def get_user_history(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_user_history(db: Session = Depends(get_read_db), current_user: models.User = Depends(get_current_user)):
     history_records = crud.get_user_vote_history(db, user_id=current_user.id)
     formatted_history = []
     for record in history_records:
@@ -135,11 +263,46 @@ def get_user_history(db: Session = Depends(get_db), current_user: models.User =
         formatted_history.append(schemas.VoteHistoryDetail(voting_line_name=record.voting_line_name, voting_line_dates=date_range, contestant_name=record.contestant_name, vote_count=record.vote_count, voted_at=record.created_at))
     return {"history": formatted_history}
 @app.get("/api/admin/dashboard-stats/{line_id}", response_model=schemas.DashboardStats)
-def get_stats_for_dashboard(line_id: int, db: Session = Depends(get_db), current_admin: models.Admin = Depends(get_current_admin)):
+def get_stats_for_dashboard(line_id: int, db: Session = Depends(get_read_db), current_admin: models.Admin = Depends(get_current_admin)):
     voting_line = crud.get_voting_line_by_id(db, line_id=line_id)
     if not voting_line: raise HTTPException(status_code=404, detail="Voting line not found.")
     stats = crud.get_dashboard_stats(db, voting_line_id=line_id)
     return {"voting_line_name": voting_line.name, "stats": stats}
+@app.get("/api/admin/voting-lines/{line_id}/vote-rate", response_model=schemas.VoteRateSeries)
+def get_vote_rate(line_id: int, resolution: schemas.RollupResolution = schemas.RollupResolution.minute, since: Optional[datetime] = None, until: Optional[datetime] = None, contestant_id: Optional[int] = None, db: Session = Depends(get_read_db), current_admin: models.Admin = Depends(get_current_admin)):
+    """Votes per contestant per minute/hour for momentum charts, served from the rollup tables."""
+    # Timestamps without an offset are taken as UTC
+    if since is not None and since.tzinfo is None: since = since.replace(tzinfo=timezone.utc)
+    if until is not None and until.tzinfo is None: until = until.replace(tzinfo=timezone.utc)
+    until = until or datetime.now(timezone.utc)
+    since = since or until - (timedelta(hours=1) if resolution == schemas.RollupResolution.minute else timedelta(hours=24))
+    if resolution == schemas.RollupResolution.hour:
+        since = since.replace(minute=0, second=0, microsecond=0)
+    if since >= until: raise HTTPException(status_code=400, detail="'since' must be before 'until'.")
+    points = crud.get_vote_rate_series(db, voting_line_id=line_id, resolution=resolution.value, since=since, until=until, contestant_id=contestant_id)
+    return {"voting_line_id": line_id, "resolution": resolution, "since": since, "until": until, "points": points}
+@app.get("/api/admin/voting-lines/{line_id}/results", response_model=schemas.VotingLineResults)
+def get_voting_line_results(line_id: int, verify: bool = False, db: Session = Depends(get_read_db), current_admin: models.Admin = Depends(get_current_admin)):
+    """Frozen results of a closed line; verify=true re-checks the checksum against the raw votes."""
+    result = crud.get_voting_line_result(db, voting_line_id=line_id)
+    if result is None: raise HTTPException(status_code=404, detail="Results for this voting line are not finalized yet.")
+    if verify: result = {**result, "checksum_valid": crud.verify_voting_line_result(db, voting_line_id=line_id)}
+    return result
+@app.get("/api/admin/vote-anomalies", response_model=List[schemas.VoteAnomaly])
+def get_recent_vote_anomalies(line_id: Optional[int] = None, limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db), current_admin: models.Admin = Depends(get_current_admin)):
+    """Vote bursts flagged by the streaming detector, newest first."""
+    return crud.get_vote_anomalies(db, voting_line_id=line_id, limit=limit)
+@app.get("/api/leaderboard/{line_id}", response_model=schemas.Leaderboard)
+def get_line_leaderboard(line_id: int, k: int = Query(3, ge=1, le=100), db: Session = Depends(get_read_db)):
+    """Public top-K standings for a voting line (e.g. the broadcast graphic)."""
+    leaderboard = crud.get_leaderboard(db, voting_line_id=line_id, top_k=k)
+    if leaderboard is None: raise HTTPException(status_code=404, detail="Voting line not found.")
+    return leaderboard
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """Prometheus scrape endpoint, aggregated across all gunicorn workers."""
+    body, content_type = metrics.render_latest()
+    return Response(content=body, media_type=content_type)
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Indian Idol Voting API!"}
@@ -0,0 +1,150 @@
+# ~/idol_voting/backend/metrics.py
+
+import functools
+import inspect
+import os
+import time
+from contextvars import ContextVar
+
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               CONTENT_TYPE_LATEST, generate_latest)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+
+# gunicorn runs 4 workers, so each one writes its samples to PROMETHEUS_MULTIPROC_DIR and
+# /metrics aggregates all of them (see gunicorn.conf.py). Without it we fall back to the
+# in-process registry, which is fine for a single uvicorn process.
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# --- HTTP Metrics ---
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route.",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests currently being handled.",
+    ["method"], multiprocess_mode="livesum",
+)
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "admission_queue_depth", "Requests waiting for admission, by route class.",
+    ["route_class"], multiprocess_mode="livesum",
+)
+ADMISSION_SHED = Counter("admission_shed_total", "Requests answered 503 by admission control.", ["route_class", "reason"])
+
+# --- Database Metrics ---
+DB_POOL_CHECKOUTS = Counter("db_pool_checkouts_total", "Connections checked out of the pool.")
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out.", multiprocess_mode="livesum")
+DB_POOL_CONNECTS = Counter("db_pool_connections_created_total", "New DBAPI connections opened by the pool.")
+CRUD_CALLS = Counter("crud_calls_total", "Calls per crud function.", ["function"])
+CRUD_LATENCY = Histogram(
+    "crud_duration_seconds", "Wall time per crud function call.", ["function"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+DB_QUERIES = Counter("db_queries_total", "SQL statements executed, by calling crud function.", ["function"])
+DB_QUERY_SECONDS = Counter("db_query_seconds_total", "Time spent executing SQL, by calling crud function.", ["function"])
+
+# --- Voting Metrics ---
+VOTE_SUBMISSIONS = Counter("vote_submissions_total", "Accepted /api/vote/submit calls.")
+VOTES_INGESTED = Counter("votes_ingested_total", "Individual votes accepted (sum of vote counts).")
+
+# --- OTP Delivery Metrics ---
+OTP_DELIVERIES = Counter("otp_deliveries_total", "OTP messages by channel and outcome (sent, retried, failed, dropped).", ["channel", "outcome"])
+
+# Name of the crud function currently running, so SQL can be attributed to it
+_current_crud = ContextVar("current_crud", default="other")
+
+
+def current_crud() -> str:
+    """Name of the crud function running in this context ("other" outside crud)."""
+    return _current_crud.get()
+
+
+def route_label(request) -> str:
+    """Returns the route template (e.g. /api/admin/dashboard-stats/{line_id}) to keep label cardinality bounded."""
+    route = request.scope.get("route")
+    return getattr(route, "path_format", None) or getattr(route, "path", None) or "unmatched"
+
+
+async def track_requests(request, call_next):
+    """HTTP middleware recording in-flight requests and latency per route."""
+    method = request.method
+    REQUESTS_IN_PROGRESS.labels(method).inc()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        REQUESTS_IN_PROGRESS.labels(method).dec()
+        REQUEST_LATENCY.labels(method, route_label(request), str(status_code)).observe(time.perf_counter() - start)
+
+
+def record_votes(total_votes: int):
+    VOTE_SUBMISSIONS.inc()
+    VOTES_INGESTED.inc(total_votes)
+
+
+def _timed(name, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = _current_crud.set(name)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            CRUD_LATENCY.labels(name).observe(time.perf_counter() - start)
+            CRUD_CALLS.labels(name).inc()
+            _current_crud.reset(token)
+    wrapper.__wrapped_crud__ = True
+    return wrapper
+
+
+def instrument_crud(module):
+    """Wraps every public function defined in `module` with call count/latency tracking."""
+    for name, fn in list(vars(module).items()):
+        if name.startswith("_") or not inspect.isfunction(fn) or fn.__module__ != module.__name__:
+            continue
+        if getattr(fn, "__wrapped_crud__", False):
+            continue
+        setattr(module, name, _timed(name, fn))
+
+
+def instrument_engine(engine):
+    """Hooks pool and cursor events on the engine to feed the DB metrics."""
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        DB_POOL_CONNECTS.inc()
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_CHECKOUTS.inc()
+        DB_POOL_CHECKED_OUT.inc()
+
+    @event.listens_for(engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        DB_POOL_CHECKED_OUT.dec()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_query_start"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop("metrics_query_start", None)
+        name = _current_crud.get()
+        DB_QUERIES.labels(name).inc()
+        if start is not None:
+            DB_QUERY_SECONDS.labels(name).inc(time.perf_counter() - start)
+
+
+def render_latest():
+    """Returns (body, content_type) for the /metrics endpoint."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
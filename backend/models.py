@@ -1,6 +1,6 @@
 # ~/idol_voting/backend/models.py
 
-from sqlalchemy import (Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Table, CheckConstraint)
+from sqlalchemy import (Column, Integer, BigInteger, String, DateTime, Boolean, ForeignKey, Text, Table, CheckConstraint, UniqueConstraint)
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -51,6 +51,8 @@ class VotingLine(Base):
     end_time = Column(DateTime(timezone=True), nullable=False)
     max_votes_per_user = Column(Integer, default=50)
     is_active = Column(Boolean, default=False)
+    # Last time is_active was set, by an admin or the scheduler; see crud.apply_voting_line_schedule
+    status_changed_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     contestants = relationship("Contestant", secondary=voting_line_contestants, back_populates="voting_lines")
@@ -62,7 +64,8 @@ class Vote(Base):
     contestant_id = Column(Integer, ForeignKey("contestants.id"), nullable=False)
     voting_line_id = Column(Integer, ForeignKey("voting_lines.id"), nullable=False)
     vote_count = Column(Integer, default=1)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Indexed for crud.reconcile_vote_aggregates, which scans the last hour of votes
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     user = relationship("User", back_populates="votes")
     contestant = relationship("Contestant", back_populates="votes")
@@ -76,5 +79,88 @@ class OTP(Base):
     otp_code = Column(String, nullable=False)
     expiry_timestamp = Column(DateTime(timezone=True), nullable=False)
     is_used = Column(Boolean, default=False)
+    # Wrong codes entered for this OTP; it is locked at crud.OTP_MAX_ATTEMPTS
+    failed_attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_key'),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    key = Column(String(255), nullable=False)
+    status_code = Column(Integer, nullable=False, default=200)
+    response_body = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class VotingLineTally(Base):
+    """Running vote total per contestant on a line, kept up to date by the vote ingest path."""
+    __tablename__ = "voting_line_tallies"
+    voting_line_id = Column(Integer, ForeignKey("voting_lines.id"), primary_key=True)
+    contestant_id = Column(Integer, ForeignKey("contestants.id"), primary_key=True)
+    total_votes = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class VoteRollupMinute(Base):
+    """Votes per contestant per minute, written by the vote ingest path."""
+    __tablename__ = "vote_rollups_minute"
+    voting_line_id = Column(Integer, ForeignKey("voting_lines.id"), primary_key=True)
+    contestant_id = Column(Integer, ForeignKey("contestants.id"), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    votes = Column(BigInteger, nullable=False, default=0)
+
+class VoteRollupHour(Base):
+    """Votes per contestant per hour, compacted from minute rollups once they age out."""
+    __tablename__ = "vote_rollups_hourly"
+    voting_line_id = Column(Integer, ForeignKey("voting_lines.id"), primary_key=True)
+    contestant_id = Column(Integer, ForeignKey("contestants.id"), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    votes = Column(BigInteger, nullable=False, default=0)
+
+class VoteAnomaly(Base):
+    """A vote burst flagged by the streaming detector (see anomaly.py)."""
+    __tablename__ = "vote_anomalies"
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    voting_line_id = Column(Integer, ForeignKey("voting_lines.id"), nullable=True, index=True)
+    observed = Column(Integer, nullable=False)
+    threshold = Column(Integer, nullable=False)
+    window_seconds = Column(Integer, nullable=False)
+    detected_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class VotingLineResult(Base):
+    """Frozen results of a line, written once after its end_time (see crud.finalize_closed_voting_lines)."""
+    __tablename__ = "voting_line_results"
+    voting_line_id = Column(Integer, ForeignKey("voting_lines.id"), primary_key=True)
+    total_votes = Column(BigInteger, nullable=False)
+    unique_voters = Column(Integer, nullable=False)
+    # sha256 over the per-contestant totals aggregated from the raw votes
+    checksum = Column(String(64), nullable=False)
+    finalized_at = Column(DateTime(timezone=True), nullable=False)
+    entries = relationship("VotingLineResultEntry", order_by="VotingLineResultEntry.rank", lazy="selectin")
+
+class VotingLineResultEntry(Base):
+    __tablename__ = "voting_line_result_entries"
+    voting_line_id = Column(Integer, ForeignKey("voting_line_results.voting_line_id"), primary_key=True)
+    contestant_id = Column(Integer, ForeignKey("contestants.id"), primary_key=True)
+    contestant_name = Column(String, nullable=False)
+    total_votes = Column(BigInteger, nullable=False)
+    rank = Column(Integer, nullable=False)
+
+class RefreshTokenFamily(Base):
+    """A chain of rotated refresh tokens from one OTP login; only the newest token's hash is kept."""
+    __tablename__ = "refresh_token_families"
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    # sha256 of the secret part of the current token; presenting an older one revokes the family
+    token_hash = Column(String(64), nullable=False)
+    generation = Column(Integer, nullable=False, default=0)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    revoked_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
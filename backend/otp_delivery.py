@@ -0,0 +1,206 @@
+# ~/idol_voting/backend/otp_delivery.py
+"""
+Asynchronous OTP delivery.
+
+/api/auth/send-otp stores the OTP, enqueues an OTPMessage here and returns; it never waits
+on an SMS or email gateway. A background thread per worker drains the queue and hands the
+messages to the provider of their channel (sms for mobile numbers, email for addresses) in
+batches of up to the provider's max_batch. Messages a provider could not send are retried
+with exponential backoff and jitter, at most OTP_DELIVERY_MAX_ATTEMPTS times and never past
+the OTP's expiry.
+
+Providers are chosen with OTP_SMS_PROVIDER / OTP_EMAIL_PROVIDER:
+- console: prints the code, like send-otp always did (the default)
+- fake: keeps the messages in memory, with optional latency and failure rate
+  (OTP_FAKE_LATENCY_MS, OTP_FAKE_FAILURE_RATE), for tests and benchmarks
+"""
+import heapq
+import itertools
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import timezone
+
+import metrics
+
+logger = logging.getLogger("idol_voting.otp_delivery")
+
+BATCH_SIZE = int(os.getenv("OTP_DELIVERY_BATCH_SIZE", "100"))
+MAX_PENDING = int(os.getenv("OTP_DELIVERY_MAX_PENDING", "10000"))
+MAX_ATTEMPTS = int(os.getenv("OTP_DELIVERY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.getenv("OTP_DELIVERY_RETRY_BASE_SECONDS", "1"))
+RETRY_MAX_SECONDS = 30.0
+
+# expires_at is a Unix timestamp
+OTPMessage = namedtuple("OTPMessage", "channel recipient code expires_at")
+
+
+def message_for(otp) -> OTPMessage:
+    """Builds the message for a models.OTP row."""
+    expiry = otp.expiry_timestamp
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)  # create_otp stores naive UTC
+    if otp.mobile_number:
+        return OTPMessage("sms", otp.mobile_number, otp.otp_code, expiry.timestamp())
+    return OTPMessage("email", otp.email, otp.otp_code, expiry.timestamp())
+
+
+# --- Providers ---
+class OTPProvider:
+    name = "base"
+
+    def __init__(self, max_batch: int = BATCH_SIZE):
+        self.max_batch = max_batch
+
+    def send_batch(self, messages: list) -> list:
+        """Sends the messages and returns the ones that failed and should be retried."""
+        raise NotImplementedError
+
+
+class ConsoleProvider(OTPProvider):
+    name = "console"
+
+    def send_batch(self, messages: list) -> list:
+        for message in messages:
+            print(f"OTP for {message.recipient}: {message.code}")  # For testing
+        return []
+
+
+class FakeProvider(OTPProvider):
+    """Records what it was asked to send; each message fails with probability failure_rate."""
+    name = "fake"
+
+    def __init__(self, max_batch: int = BATCH_SIZE, latency: float = 0.0, failure_rate: float = 0.0):
+        super().__init__(max_batch)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+        self.batches = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages: list) -> list:
+        if self.latency:
+            time.sleep(self.latency)  # one gateway round trip per batch
+        failed = [message for message in messages if random.random() < self.failure_rate]
+        with self._lock:
+            self.batches += 1
+            self.failures += len(failed)
+            self.sent.extend(message for message in messages if message not in failed)
+        return failed
+
+
+def provider_from_env(channel: str) -> OTPProvider:
+    name = os.getenv(f"OTP_{channel.upper()}_PROVIDER", "console")
+    if name == "fake":
+        return FakeProvider(
+            latency=float(os.getenv("OTP_FAKE_LATENCY_MS", "0")) / 1000,
+            failure_rate=float(os.getenv("OTP_FAKE_FAILURE_RATE", "0")),
+        )
+    if name == "console":
+        return ConsoleProvider()
+    raise ValueError(f"Unknown OTP_{channel.upper()}_PROVIDER: {name}")
+
+
+# --- Delivery Queue ---
+class OTPDeliveryQueue:
+    def __init__(self, providers: dict, max_pending: int = MAX_PENDING, max_attempts: int = MAX_ATTEMPTS):
+        self.providers = providers
+        self.max_attempts = max_attempts
+        self._pending = queue.Queue(maxsize=max_pending)
+        # (due, seq, attempt, message) heap of failed sends; only the worker thread touches it
+        self._retries = []
+        self._seq = itertools.count()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def enqueue(self, message: OTPMessage) -> bool:
+        """Called from the send-otp path; never blocks. Returns False if the queue is full."""
+        try:
+            self._pending.put_nowait((1, message))
+        except queue.Full:
+            metrics.OTP_DELIVERIES.labels(message.channel, "dropped").inc()
+            return False
+        return True
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="otp-delivery", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self._thread = None
+
+    def deliver(self, batch: list):
+        """Sends (attempt, message) pairs, grouped by channel and chunked to each provider's max_batch."""
+        by_channel = defaultdict(list)
+        for attempt, message in batch:
+            by_channel[message.channel].append((attempt, message))
+        for channel, items in by_channel.items():
+            provider = self.providers[channel]
+            for start in range(0, len(items), provider.max_batch):
+                chunk = items[start:start + provider.max_batch]
+                try:
+                    failed = provider.send_batch([message for _, message in chunk])
+                except Exception:
+                    logger.exception("OTP provider %s failed a batch of %d", provider.name, len(chunk))
+                    failed = [message for _, message in chunk]
+                failed = set(failed)
+                for attempt, message in chunk:
+                    if message in failed:
+                        self._retry(attempt, message)
+                    else:
+                        metrics.OTP_DELIVERIES.labels(channel, "sent").inc()
+
+    def _retry(self, attempt: int, message: OTPMessage):
+        backoff = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+        due = time.time() + backoff * random.uniform(0.5, 1.0)
+        if attempt >= self.max_attempts or due >= message.expires_at or self._stopped.is_set():
+            metrics.OTP_DELIVERIES.labels(message.channel, "failed").inc()
+            logger.warning("Giving up on OTP %s delivery after %d attempts", message.channel, attempt)
+            return
+        metrics.OTP_DELIVERIES.labels(message.channel, "retried").inc()
+        heapq.heappush(self._retries, (due, next(self._seq), attempt + 1, message))
+
+    def _take_batch(self, timeout: float) -> list:
+        batch = []
+        try:
+            batch.append(self._pending.get(timeout=timeout))
+        except queue.Empty:
+            pass
+        # Take whatever else is queued so providers see full batches under load
+        while len(batch) < BATCH_SIZE * len(self.providers):
+            try:
+                batch.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        now = time.time()
+        while self._retries and self._retries[0][0] <= now:
+            _, _, attempt, message = heapq.heappop(self._retries)
+            batch.append((attempt, message))
+        return batch
+
+    def _run(self):
+        while not self._stopped.is_set():
+            timeout = min(1.0, self._retries[0][0] - time.time()) if self._retries else 1.0
+            batch = self._take_batch(max(timeout, 0.0))
+            if batch:
+                self.deliver(batch)
+        # Shutting down: one last attempt for whatever is still queued, without retries
+        batch = self._take_batch(0)
+        while batch:
+            self.deliver(batch)
+            batch = self._take_batch(0)
+
+
+# One queue per worker process, started and stopped by the app's lifespan in main.py
+delivery_queue = OTPDeliveryQueue({"sms": provider_from_env("sms"), "email": provider_from_env("email")})
@@ -0,0 +1,106 @@
+# ~/idol_voting/backend/profiling.py
+
+import json
+import logging
+import os
+import re
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+import metrics
+
+logger = logging.getLogger("idol_voting.slow_requests")
+
+# Requests whose DB time or total time exceeds these thresholds are logged.
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_DB_MS = float(os.getenv("SLOW_DB_MS", "200"))
+# Adds an X-DB-Profile header with the per-request summary (off by default).
+PROFILE_HEADER_ENABLED = os.getenv("SQL_PROFILE_HEADER", "false").lower() in ("1", "true", "yes")
+
+_request_profile = ContextVar("request_profile", default=None)
+
+
+class RequestProfile:
+    """Query count, total DB time and the slowest statement of a single request."""
+    __slots__ = ("query_count", "db_time", "slowest_time", "slowest_statement", "slowest_function")
+
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+        self.slowest_function = None
+
+    def record(self, statement: str, elapsed: float):
+        self.query_count += 1
+        self.db_time += elapsed
+        if elapsed > self.slowest_time:
+            # Only keep a reference here; normalizing is deferred to the slow path.
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+            self.slowest_function = metrics.current_crud()
+
+    def header_value(self) -> str:
+        return f"queries={self.query_count};db_ms={self.db_time * 1000:.2f};slowest_ms={self.slowest_time * 1000:.2f}"
+
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = r"(?:\?|%\(\w+\)s|%s|:\w+)"
+_PLACEHOLDER_LIST = re.compile(r"\(\s*" + _PLACEHOLDER + r"(?:\s*,\s*" + _PLACEHOLDER + r")+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_sql(statement: str) -> str:
+    """Strips literals and collapses placeholder lists so similar statements group together."""
+    if not statement:
+        return statement
+    sql = _STRING_LITERAL.sub("?", statement)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(...)", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+def instrument_engine(engine):
+    """Attributes every statement executed on `engine` to the current request's profile."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        if _request_profile.get() is not None:
+            conn.info["profile_query_start"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop("profile_query_start", None)
+        profile = _request_profile.get()
+        if start is not None and profile is not None:
+            profile.record(statement, time.perf_counter() - start)
+
+
+async def profile_requests(request, call_next):
+    """HTTP middleware that profiles SQL per request and logs slow requests."""
+    profile = RequestProfile()
+    token = _request_profile.set(profile)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _request_profile.reset(token)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    db_ms = profile.db_time * 1000
+    if elapsed_ms >= SLOW_REQUEST_MS or db_ms >= SLOW_DB_MS:
+        logger.warning(json.dumps({
+            "event": "slow_request",
+            "method": request.method,
+            "route": metrics.route_label(request),
+            "status": response.status_code,
+            "duration_ms": round(elapsed_ms, 2),
+            "db_ms": round(db_ms, 2),
+            "query_count": profile.query_count,
+            "slowest_ms": round(profile.slowest_time * 1000, 2),
+            "slowest_function": profile.slowest_function,
+            "slowest_sql": normalize_sql(profile.slowest_statement),
+        }))
+    if PROFILE_HEADER_ENABLED:
+        response.headers["X-DB-Profile"] = profile.header_value()
+    return response
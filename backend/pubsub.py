@@ -0,0 +1,137 @@
+# ~/idol_voting/backend/pubsub.py
+"""
+Cross-worker cache invalidation over Postgres LISTEN/NOTIFY.
+
+Writers call `publish(db, kind, key)` inside their transaction; Postgres only delivers the
+notification once that transaction commits. Every worker runs a `CacheInvalidationListener`
+that receives it and calls the handlers registered for that kind with `subscribe`.
+On anything other than Postgres (e.g. SQLite in development) publishing is a no-op.
+
+Run `python pubsub.py` to print the notifications going through DATABASE_URL.
+"""
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+
+from sqlalchemy import text
+
+logger = logging.getLogger("idol_voting.pubsub")
+
+CHANNEL = "idol_voting_cache"
+
+_handlers = defaultdict(list)
+
+
+def subscribe(kind: str, handler):
+    """Registers `handler(key)` for notifications of `kind`; key None means "everything"."""
+    _handlers[kind].append(handler)
+
+
+def publish(db, kind: str, key=None):
+    """Queues a notification in the session's current transaction (sent on commit)."""
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    payload = json.dumps({"kind": kind, "key": key})
+    db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload})
+
+
+def _call_handlers(kind: str, key):
+    # One failing handler must neither skip the others nor break the listener's connection
+    for handler in _handlers.get(kind, ()):
+        try:
+            handler(key)
+        except Exception:
+            logger.exception("Cache invalidation handler failed for %s", kind)
+
+
+def dispatch(payload: str):
+    try:
+        message = json.loads(payload)
+        kind, key = message["kind"], message.get("key")
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Ignoring malformed cache notification: %r", payload)
+        return
+    _call_handlers(kind, key)
+
+
+def invalidate_everything():
+    for kind in list(_handlers):
+        _call_handlers(kind, None)
+
+
+class CacheInvalidationListener:
+    """Background thread holding a dedicated LISTEN connection for one worker."""
+
+    def __init__(self, engine, channel: str = CHANNEL, poll_seconds: float = 5.0):
+        self.engine = engine
+        self.channel = channel
+        self.poll_seconds = poll_seconds
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.engine.dialect.name != "postgresql" or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-invalidation-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_seconds + 1)
+        self._thread = None
+
+    def _connect(self):
+        # A raw DBAPI connection outside the pool: it lives as long as the worker does
+        cargs, cparams = self.engine.dialect.create_connect_args(self.engine.url)
+        connection = self.engine.dialect.dbapi.connect(*cargs, **cparams)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return connection
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = self._connect()
+                # Anything published while we were not listening is lost, so start clean
+                invalidate_everything()
+                backoff = 1.0
+                while not self._stopped.is_set():
+                    if select.select([connection], [], [], self.poll_seconds) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        dispatch(connection.notifies.pop(0).payload)
+            except Exception:
+                logger.exception("Cache invalidation listener lost its connection; retrying in %.0fs", backoff)
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+
+if __name__ == "__main__":
+    import time
+    from database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    for kind in ("admin", "contestant", "voting_line"):
+        subscribe(kind, lambda key, kind=kind: print(f"{kind}: {key}"))
+    listener = CacheInvalidationListener(engine)
+    listener.start()
+    print(f"Listening on {CHANNEL} (Ctrl+C to stop)...")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        listener.stop()
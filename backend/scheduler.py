@@ -0,0 +1,154 @@
+# ~/idol_voting/backend/scheduler.py
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+import crud
+import journal
+import pubsub
+from database import SessionLocal
+
+logger = logging.getLogger("idol_voting.scheduler")
+
+# Even without a boundary coming up, re-read the schedule this often to pick up lines
+# created or toggled through other workers.
+RESYNC_SECONDS = float(os.getenv("SCHEDULER_RESYNC_SECONDS", "10"))
+
+
+class VotingLineScheduler:
+    """
+    Opens and closes voting lines at their start_time / end_time.
+
+    Every worker runs one of these in a background thread. It sleeps until the next line
+    boundary, flips is_active with a conditional UPDATE (so the change is written once no
+    matter how many workers wake up) and then reloads the open lines into memory. Request
+    handlers read `open_lines()` instead of running a time-filtered query.
+    """
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self._open_lines = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._next_boundary = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        # The first tick also applies boundaries that passed while no worker was running
+        self._stopped.clear()
+        try:
+            self._next_boundary = self.tick()
+        except Exception:
+            # Keep booting; handlers fall back to querying the DB until a tick succeeds
+            logger.exception("Initial voting line schedule load failed")
+        self._thread = threading.Thread(target=self._run, name="voting-line-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+        self._open_lines = None
+
+    def wake(self):
+        """Re-reads the schedule right away (e.g. after an admin changed a line)."""
+        self._wakeup.set()
+
+    def open_lines(self):
+        """line_id -> (start_time, end_time) of active lines, or None if the scheduler is not running."""
+        return self._open_lines
+
+    def tick(self) -> datetime:
+        """Applies due transitions, reloads the open lines and returns the next boundary (or None)."""
+        now = datetime.now(timezone.utc)
+        db = self.session_factory()
+        try:
+            changed = crud.apply_voting_line_schedule(db, now=now)
+            schedule = crud.get_voting_line_schedule(db, now)
+        finally:
+            db.close()
+        if changed:
+            logger.info("Voting lines changed state: %s", changed)
+
+        previous = self._open_lines or {}
+        self._open_lines = {line_id: (start, end) for line_id, start, end, is_active in schedule if is_active}
+        # Lines toggled by another worker still sit in our line cache with the old is_active
+        for line_id in previous.keys() ^ self._open_lines.keys():
+            crud.invalidate_voting_line(line_id)
+
+        upcoming = [start for _, start, _, is_active in schedule if not is_active and start > now]
+        upcoming += [end for _, _, end, is_active in schedule if is_active]
+        # end_time is inclusive, so wake just after a boundary rather than exactly on it
+        return min(upcoming) + timedelta(milliseconds=1) if upcoming else None
+
+    def _run(self):
+        next_boundary = self._next_boundary
+        while not self._stopped.is_set():
+            timeout = RESYNC_SECONDS
+            if next_boundary is not None:
+                until_boundary = (next_boundary - datetime.now(timezone.utc)).total_seconds()
+                timeout = max(0.0, min(timeout, until_boundary))
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                next_boundary = self.tick()
+            except Exception:
+                logger.exception("Voting line scheduler tick failed")
+                next_boundary = None
+
+
+class PeriodicTask:
+    """Runs `task(db)` every `interval` seconds in a background thread, with its own session."""
+
+    def __init__(self, name: str, task, interval: float, session_factory):
+        self.name = name
+        self.task = task
+        self.interval = interval
+        self.session_factory = session_factory
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def run_once(self):
+        db = self.session_factory()
+        try:
+            self.task(db)
+        except Exception:
+            logger.exception("Periodic task %s failed", self.name)
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.run_once()
+
+
+# One scheduler per worker process, started and stopped by the app's lifespan in main.py
+scheduler = VotingLineScheduler(SessionLocal)
+pubsub.subscribe("voting_line", lambda line_id: scheduler.wake())
+rollup_compactor = PeriodicTask("vote-rollup-compactor", crud.compact_vote_rollups, float(os.getenv("ROLLUP_COMPACTION_SECONDS", "300")), SessionLocal)
+aggregate_flusher = PeriodicTask("vote-aggregate-flusher", crud.flush_vote_aggregates, crud.AGGREGATE_FLUSH_SECONDS, SessionLocal)
+aggregate_reconciler = PeriodicTask("vote-aggregate-reconciler", crud.reconcile_vote_aggregates, float(os.getenv("AGGREGATE_RECONCILE_SECONDS", "60")), SessionLocal)
+results_finalizer = PeriodicTask("results-finalizer", crud.finalize_closed_voting_lines, float(os.getenv("RESULTS_FINALIZE_SECONDS", "30")), SessionLocal)
+# Only started when the vote journal is enabled (VOTE_JOURNAL_DIR)
+journal_replayer = PeriodicTask("vote-journal-replayer", journal.replay_journal, float(os.getenv("VOTE_JOURNAL_REPLAY_SECONDS", "5")), SessionLocal)
@@ -1,7 +1,8 @@
 # ~/idol_voting/backend/schemas.py
 
-from pydantic import BaseModel, Field, model_validator
+from pydantic import BaseModel, Field, NonNegativeInt, field_validator, model_validator
 from datetime import datetime
+import re
 from typing import List, Dict, Optional
 from enum import Enum
 
@@ -19,6 +20,18 @@ class GenderEnum(str, Enum):
     
     
 # --- User Auth Schemas (HIGHLIGHT: Major updates) ---
+# Identifiers are normalized before they are stored or looked up, so "+91 98765-43210" and
+# "+919876543210" (or "Fan@Example.com" and "fan@example.com") are the same user.
+def normalize_mobile(value):
+    if not isinstance(value, str):
+        return value
+    return re.sub(r"[\s\-().]", "", value) or None
+
+def normalize_email(value):
+    if not isinstance(value, str):
+        return value
+    return value.strip().lower() or None
+
 class IdentifierRequest(BaseModel):
     mobile_number: Optional[str] = None
     email: Optional[str] = None
@@ -27,17 +40,23 @@ class IdentifierRequest(BaseModel):
     @model_validator(mode='before')
     def check_at_least_one_identifier(cls, values):
         # This logic explicitly checks if a valid mobile number or email is present.
-        if 'mobile_number' in values and values['mobile_number']:
+        if 'mobile_number' in values and normalize_mobile(values['mobile_number']):
             return values
-        if 'email' in values and values['email']:
+        if 'email' in values and normalize_email(values['email']):
             return values
         raise ValueError('Either mobile_number or email must be provided')
+
+    _normalize_mobile = field_validator('mobile_number', mode='before')(normalize_mobile)
+    _normalize_email = field_validator('email', mode='before')(normalize_email)
         
         
 class OTPVerifyRequest(BaseModel):
     mobile_number: Optional[str] = None
     email: Optional[str] = None
     otp_code: str
+
+    _normalize_mobile = field_validator('mobile_number', mode='before')(normalize_mobile)
+    _normalize_email = field_validator('email', mode='before')(normalize_email)
 class UserBase(BaseModel):
     mobile_number: Optional[str] = None
     email: Optional[str] = None
@@ -72,15 +91,21 @@ class Contestant(ContestantBase):
     class Config:
         from_attributes = True
 
+class ContestantImportResult(BaseModel):
+    created: int
+    contestant_ids: List[int]
+
 # --- Voting Line Schemas ---
 class VotingLineBase(BaseModel):
     name: str
     start_time: datetime
     end_time: datetime
     max_votes_per_user: int
+# A line never has more contestants than this, so larger vote submissions are rejected outright
+MAX_VOTE_ENTRIES = 100
 class VotingLineCreate(VotingLineBase):
     # HIGHLIGHT: Add a list to accept contestant IDs
-    contestant_ids: List[int] = []
+    contestant_ids: List[int] = Field([], max_length=MAX_VOTE_ENTRIES)
 class VotingLine(VotingLineBase):
     id: int
     is_active: bool
@@ -93,7 +118,9 @@ class VotingLine(VotingLineBase):
 
 # --- Voting Schemas ---
 class VoteSubmitRequest(BaseModel):
-    votes: Dict[int, int] = Field(..., example={1: 10, 2: 40})
+    # HIGHLIGHT: Target a specific line; omitted means the earliest open line
+    voting_line_id: Optional[int] = None
+    votes: Dict[int, NonNegativeInt] = Field(..., max_length=MAX_VOTE_ENTRIES, example={1: 10, 2: 40})
 class PublicVotingPage(BaseModel):
     voting_line: VotingLine
     contestants: List[Contestant]
@@ -112,6 +139,81 @@ class DashboardStats(BaseModel):
 
 
 
+# --- Leaderboard Schemas (HIGHLIGHT: New section) ---
+class LeaderboardEntry(BaseModel):
+    rank: int
+    contestant_id: int
+    contestant_name: str
+    total_votes: int
+    vote_share: float
+
+class Leaderboard(BaseModel):
+    voting_line_id: int
+    voting_line_name: str
+    total_votes: int
+    entries: List[LeaderboardEntry]
+    generated_at: datetime
+
+
+
+
+# --- Voting Line Result Schemas (HIGHLIGHT: New section) ---
+class VotingLineResultEntry(BaseModel):
+    rank: int
+    contestant_id: int
+    contestant_name: str
+    total_votes: int
+
+class VotingLineResults(BaseModel):
+    voting_line_id: int
+    voting_line_name: str
+    total_votes: int
+    unique_voters: int
+    checksum: str
+    finalized_at: datetime
+    entries: List[VotingLineResultEntry]
+    # Only set when the checksum was re-verified against the raw votes
+    checksum_valid: Optional[bool] = None
+
+
+
+
+# --- Vote Rate Schemas (HIGHLIGHT: New section) ---
+class RollupResolution(str, Enum):
+    minute = "minute"
+    hour = "hour"
+
+class VoteRatePoint(BaseModel):
+    bucket_start: datetime
+    contestant_id: int
+    votes: int
+
+class VoteRateSeries(BaseModel):
+    voting_line_id: int
+    resolution: RollupResolution
+    since: datetime
+    until: datetime
+    points: List[VoteRatePoint]
+
+
+
+
+# --- Vote Anomaly Schemas (HIGHLIGHT: New section) ---
+class VoteAnomaly(BaseModel):
+    id: int
+    kind: str
+    key: str
+    voting_line_id: int | None = None
+    observed: int
+    threshold: int
+    window_seconds: int
+    detected_at: datetime
+    class Config:
+        from_attributes = True
+
+
+
+
 # --- Vote History Schemas (HIGHLIGHT: New section) ---
 class VoteHistoryDetail(BaseModel):
     voting_line_name: str
@@ -132,3 +234,7 @@ class StatusResponse(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
@@ -1,10 +1,15 @@
 # ~/idol_voting/backend/security.py
 
+import hashlib
+import secrets
+import time
 from datetime import datetime, timedelta, timezone
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import os
 
+from cache import TTLCache
+
 # --- Password Hashing ---
 # We use bcrypt for hashing passwords
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -31,3 +36,43 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+# --- Verified Token Cache ---
+# Clients send the same token on every request of a session, so each worker remembers the
+# payloads of tokens it already verified. Entries are keyed by a digest of the token (raw
+# tokens are never kept) and expire at the token's own `exp`.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+def decode_access_token(token: str) -> dict:
+    """Verifies a JWT and returns its payload, from the cache when possible. Raises JWTError."""
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(digest)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        expires_in = payload.get("exp", 0) - time.time()
+        if expires_in > 0:
+            token_cache.set(digest, payload, ttl=expires_in)
+    return payload
+
+# --- Refresh Tokens ---
+# Opaque "<family id>.<secret>" strings. The server keeps one row per family (see
+# crud.rotate_refresh_token) holding a hash of the current secret only.
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+
+def new_refresh_family_id() -> str:
+    return secrets.token_hex(16)
+
+def new_refresh_secret() -> str:
+    return secrets.token_urlsafe(32)
+
+def hash_refresh_secret(secret: str) -> str:
+    """The secrets are random, so a plain sha256 is enough (no bcrypt on the refresh path)."""
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+def split_refresh_token(token: str):
+    """Returns (family_id, secret), or None for a malformed token."""
+    family_id, _, secret = token.partition(".")
+    if len(family_id) != 32 or not secret:
+        return None
+    return family_id, secret
@@ -0,0 +1,75 @@
+# ~/idol_voting/backend/stress_vote_quota.py
+"""
+Concurrency check for the vote quota.
+
+Creates a throwaway user, contestant and voting line, then hammers crud.submit_votes for
+that one user from many threads at once. The quota is enforced correctly if the votes
+stored never exceed max_votes_per_user and accepted submits account for all of them; the
+line's tally must match them once the buffered aggregates are flushed.
+Run it against a local Postgres (`alembic upgrade head` first); everything it creates is
+removed at the end.
+
+Usage: python stress_vote_quota.py [threads] [submits_per_thread]
+"""
+import sys
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from database import SessionLocal
+import crud
+import models
+
+MAX_VOTES = 50
+VOTES_PER_SUBMIT = 3
+
+def hammer(user_id: int, line_id: int, contestant_id: int, submits: int, outcomes: list, barrier: threading.Barrier):
+    db = SessionLocal()
+    try:
+        barrier.wait()
+        for _ in range(submits):
+            outcome = crud.submit_votes(db, user_id=user_id, voting_line_id=line_id, votes={contestant_id: VOTES_PER_SUBMIT}, max_votes=MAX_VOTES)
+            outcomes.append(outcome)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    submits = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    db = SessionLocal()
+    now = datetime.now(timezone.utc)
+    user = models.User(mobile_number=f"stress-{uuid.uuid4().hex[:12]}")
+    contestant = models.Contestant(name="Stress Test", age=20, gender="Others")
+    line = models.VotingLine(name="Stress Test", start_time=now, end_time=now + timedelta(hours=1), max_votes_per_user=MAX_VOTES, contestants=[contestant])
+    db.add_all([user, contestant, line])
+    db.commit()
+    ok = False
+    try:
+        outcomes = []
+        barrier = threading.Barrier(threads)
+        workers = [threading.Thread(target=hammer, args=(user.id, line.id, contestant.id, submits, outcomes, barrier)) for _ in range(threads)]
+        for worker in workers: worker.start()
+        for worker in workers: worker.join()
+
+        stored = crud.get_user_votes_for_line(db, user_id=user.id, voting_line_id=line.id)
+        accepted = outcomes.count(crud.VOTES_ACCEPTED)
+        print(f"--- {threads} threads x {submits} submits of {VOTES_PER_SUBMIT} votes (quota {MAX_VOTES}) ---")
+        print(f"accepted: {accepted}, rejected: {outcomes.count(crud.VOTES_REJECTED)}, votes stored: {stored}")
+        ok = stored <= MAX_VOTES and stored == accepted * VOTES_PER_SUBMIT and accepted == MAX_VOTES // VOTES_PER_SUBMIT
+        print("OK" if ok else "FAILED: quota was not enforced atomically")
+        crud.flush_vote_aggregates(db)
+        tallied = crud.get_line_tallies(db, voting_line_id=line.id).get(contestant.id, 0)
+        print(f"tally after flush: {tallied}")
+        ok = ok and tallied == stored
+    finally:
+        db.rollback()
+        for table in (models.Vote, models.VotingLineTally, models.VoteRollupMinute, models.VoteRollupHour):
+            db.query(table).filter(table.voting_line_id == line.id).delete()
+        db.delete(line)
+        db.commit()
+        db.delete(contestant)
+        db.delete(user)
+        db.commit()
+        db.close()
+    sys.exit(0 if ok else 1)